@@ -0,0 +1,167 @@
+# 벤치마크용 가짜 클라우드 서비스
+# Azure OpenAI / Custom Vision / Google 음성 인식 / gTTS 를 흉내 내요.
+# 지연 시간, 흔들림(jitter), 에러 비율, 429 비율을 정할 수 있어요.
+#
+# python bench/fake_services.py --port 9100 --latency-ms 300 --jitter-ms 100 --error-rate 0.01 --throttle-rate 0.02
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+TAGS = ['vinyl', 'styrofoam', 'glass', 'clothes', 'paper', 'can', 'computer', 'battery', 'fluorescentlamp', 'plastic']
+
+QUESTIONS = [
+    "페트병은 어떻게 버려요?",
+    "우유팩은 종이로 버려요?",
+    "건전지는 어디에 버려요?",
+    "스티로폼은 어떻게 버려요?",
+    "깨진 유리는 어떻게 버려요?",
+    "치킨 상자는 어디에 버려요?"
+]
+
+ANSWER = (
+    "좋은 질문이에요! 😊 먼저 안에 남은 내용물을 깨끗하게 비워 주세요. "
+    "라벨이 있으면 떼어 주세요! ✂️ 그다음 납작하게 눌러서 분리수거함에 넣어 주세요. "
+    "이렇게 하면 지구가 정말 좋아해요! 🌍♻️"
+)
+
+# MPEG-1 Layer III 128kbps 44.1kHz 무음 프레임 하나 (417바이트)
+SILENT_MP3_FRAME = b"\xff\xfb\x90\x00" + b"\x00" * 413
+
+config = argparse.Namespace(latency_ms=300.0, jitter_ms=100.0, error_rate=0.0, throttle_rate=0.0, token_delay_ms=20.0)
+stats = {"requests": 0, "errors": 0, "throttled": 0}
+
+app = FastAPI()
+
+
+# 설정한 지연 시간만큼 기다리고, 정해진 확률로 429 / 500 응답을 골라요
+async def simulate():
+    stats["requests"] += 1
+    delay = max(0.0, random.gauss(config.latency_ms, config.jitter_ms)) / 1000
+    await asyncio.sleep(delay)
+    roll = random.random()
+    if roll < config.throttle_rate:
+        stats["throttled"] += 1
+        return JSONResponse(
+            {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+            status_code=429,
+            headers={"Retry-After": "1", "x-ratelimit-remaining-requests": "0", "x-ratelimit-remaining-tokens": "0"}
+        )
+    if roll < config.throttle_rate + config.error_rate:
+        stats["errors"] += 1
+        return JSONResponse({"error": {"code": "500", "message": "Internal error"}}, status_code=500)
+    return None
+
+
+def chat_chunk(content=None, finish_reason=None):
+    delta = {"content": content} if content is not None else {}
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+
+
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(deployment: str, request: Request):
+    body = await request.json()
+    error = await simulate()
+    if error is not None:
+        return error
+
+    headers = {
+        "x-ratelimit-remaining-requests": "1000",
+        "x-ratelimit-remaining-tokens": "100000",
+        "x-ratelimit-limit-requests": "1000",
+        "x-ratelimit-limit-tokens": "100000"
+    }
+    words = ANSWER.split(" ")
+
+    if not body.get("stream"):
+        return JSONResponse({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-4o-mini",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": ANSWER}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 50, "completion_tokens": len(words) * 2, "total_tokens": 50 + len(words) * 2}
+        }, headers=headers)
+
+    async def events():
+        for i, word in enumerate(words):
+            content = word if i == 0 else " " + word
+            yield f"data: {json.dumps(chat_chunk(content), ensure_ascii=False)}\n\n"
+            await asyncio.sleep(config.token_delay_ms / 1000)
+        yield f"data: {json.dumps(chat_chunk(finish_reason='stop'))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+
+@app.post("/customvision/v3.0/Prediction/{project_id}/classify/iterations/{iteration}/image")
+async def custom_vision(project_id: str, iteration: str, request: Request):
+    await request.body()
+    error = await simulate()
+    if error is not None:
+        return error
+    scores = [random.random() for _ in TAGS]
+    total = sum(scores)
+    predictions = sorted(
+        ({"tagName": tag, "probability": score / total} for tag, score in zip(TAGS, scores)),
+        key=lambda p: p["probability"],
+        reverse=True
+    )
+    return {"id": "fake", "project": project_id, "iteration": iteration, "predictions": predictions}
+
+
+@app.post("/stt")
+async def speech_to_text(request: Request):
+    await request.body()
+    error = await simulate()
+    if error is not None:
+        return error
+    return {"text": random.choice(QUESTIONS)}
+
+
+@app.post("/tts")
+async def text_to_speech(request: Request):
+    body = await request.json()
+    error = await simulate()
+    if error is not None:
+        return error
+    # 글자 수에 비례하는 길이의 무음 mp3
+    frames = max(1, len(body.get("text", "")) // 4)
+    return Response(SILENT_MP3_FRAME * frames, media_type="audio/mpeg")
+
+
+@app.get("/stats")
+async def service_stats():
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="꼬마환경탐정 벤치마크용 가짜 클라우드 서비스")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=config.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=config.jitter_ms)
+    parser.add_argument("--token-delay-ms", type=float, default=config.token_delay_ms)
+    parser.add_argument("--error-rate", type=float, default=config.error_rate)
+    parser.add_argument("--throttle-rate", type=float, default=config.throttle_rate)
+    args = parser.parse_args()
+    for name in ("latency_ms", "jitter_ms", "token_delay_ms", "error_rate", "throttle_rate"):
+        setattr(config, name, getattr(args, name))
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
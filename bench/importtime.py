@@ -0,0 +1,80 @@
+# 시작 시간 점검: python -X importtime 으로 main.py 를 import 하는 데 걸린 시간을 재요.
+# CI에서 예산(--budget-ms)을 넘으면 실패해요.
+#
+# python bench/importtime.py --top 20 --budget-ms 4000
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+# 처음 쓸 때 import 해야 하는 모듈 (main.py 의 LazyModule)
+LAZY_MODULES = ("openai", "speech_recognition", "gtts", "emoji", "onnxruntime", "vosk", "faster_whisper")
+
+# 시작할 때 꼭 import 되는 모듈 (예산에 포함돼요)
+# gradio: import 할 때 gr.Blocks / mount_gradio_app 으로 app 을 만들어야 해요
+# PIL, numpy: gradio 가 어차피 import 해요 (main.py 에서 미뤄도 시간이 줄지 않아요)
+EAGER_MODULES = ("gradio", "PIL", "numpy")
+
+
+def profile(module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(result.returncode)
+
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="main.py import 시간 보고서")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=None, help="이 시간을 넘으면 종료 코드 1")
+    args = parser.parse_args()
+
+    rows = profile(args.module)
+    total_ms = next((cumulative for name, _, cumulative, _ in rows if name == args.module), 0) / 1000
+
+    # 최상위 패키지(들여쓰기 없는 줄)만 모아서 누적 시간 순으로 보여줘요
+    top_level = sorted((row for row in rows if row[3] == 0 and row[0] != args.module), key=lambda row: row[2], reverse=True)
+    print(f"{args.module} import: {total_ms:.0f} ms")
+    print(f"{'패키지':<40} {'누적(ms)':>10} {'자체(ms)':>10}")
+    for name, self_us, cumulative_us, _ in top_level[:args.top]:
+        print(f"{name:<40} {cumulative_us / 1000:>10.1f} {self_us / 1000:>10.1f}")
+
+    # 한 모듈이 여러 번 나오면 처음(실제로 불러온) 줄의 누적 시간을 써요
+    print(f"\n{'시작할 때 필요한 모듈':<40} {'누적(ms)':>10}")
+    for module in EAGER_MODULES:
+        cumulative = next((c for name, _, c, _ in rows if name == module), None)
+        shown = f"{cumulative / 1000:>10.1f}" if cumulative is not None else f"{'(다른 모듈 안에서)':>10}"
+        print(f"{module:<40} {shown}")
+
+    eager = sorted({name.split(".")[0] for name, *_ in rows} & set(LAZY_MODULES))
+    if eager:
+        print(f"\n⚠️ 처음 쓸 때 불러와야 할 모듈이 시작할 때 import 됐어요: {', '.join(eager)}")
+
+    failed = bool(eager)
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"\n❌ 예산 {args.budget_ms:.0f} ms 초과")
+        failed = True
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# 꼬마환경탐정 부하 테스트
+# 동시 사용자 N명이 이미지 분류 / 음성 질문 / 퀴즈 점수 보내기를 반복하면서
+# 시나리오별 p50/p95/p99 지연 시간과 초당 요청 수를 재요.
+#
+# 가짜 서비스와 앱까지 한 번에 띄우기:
+#   python bench/loadtest.py --spawn --users 30 --requests 10
+# 이미 떠 있는 앱에 붙기:
+#   python bench/loadtest.py --url http://127.0.0.1:7870 --users 30 --requests 10
+
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, "bench")
+SAMPLE_IMAGE = os.path.join(ROOT, "temp.jpg")
+
+QUIZ_IDS = ["paper-cup", "chicken-box"]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+# 말소리 대신 0.5초 무음 + 1초 440Hz 소리 + 0.5초 무음 (44.1kHz, VAD가 잘라낼 구간 포함)
+def make_voice_sample(path):
+    rate = 44100
+    frames = bytearray()
+    for i in range(rate * 2):
+        t = i / rate
+        value = int(8000 * math.sin(2 * math.pi * 440 * t)) if 0.5 <= t < 1.5 else 0
+        frames += value.to_bytes(2, "little", signed=True)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(bytes(frames))
+    return path
+
+
+# 사진 다시 쓰기 캐시를 피하고 싶을 때 쓰는 무작위 색 블록 이미지
+def make_unique_image(directory):
+    from PIL import Image
+
+    image = Image.new("RGB", (640, 480))
+    for _ in range(12):
+        x, y = random.randrange(0, 600), random.randrange(0, 440)
+        color = tuple(random.randrange(256) for _ in range(3))
+        image.paste(color, (x, y, x + random.randrange(40, 300), y + random.randrange(40, 300)))
+    path = os.path.join(directory, f"unique_{random.getrandbits(64):016x}.jpg")
+    image.save(path, quality=90)
+    return path
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, scenario, seconds, ok):
+        with self.lock:
+            if ok:
+                self.latencies.setdefault(scenario, []).append(seconds)
+            else:
+                self.errors[scenario] = self.errors.get(scenario, 0) + 1
+
+    def summary(self, elapsed):
+        report = {}
+        for scenario in sorted(set(self.latencies) | set(self.errors)):
+            values = self.latencies.get(scenario, [])
+            report[scenario] = {
+                "ok": len(values),
+                "errors": self.errors.get(scenario, 0),
+                "rps": len(values) / elapsed if elapsed else 0.0,
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000
+            }
+        return report
+
+
+def run_user(url, scenarios, requests_per_user, recorder, voice_sample, unique_images, work_dir):
+    from gradio_client import Client
+    try:
+        from gradio_client import handle_file
+    except ImportError:
+        def handle_file(path):
+            return path
+
+    client = Client(url, verbose=False)
+    http = httpx.Client(base_url=url, timeout=30)
+    for _ in range(requests_per_user):
+        scenario = random.choice(scenarios)
+        if scenario == "image":
+            image_path = make_unique_image(work_dir) if unique_images else SAMPLE_IMAGE
+            call = lambda: client.predict(handle_file(image_path), api_name="/classify")
+        elif scenario == "voice":
+            call = lambda: client.predict(handle_file(voice_sample), api_name="/voice")
+        else:
+            # 퀴즈 정답 확인은 브라우저에서 하고, 서버에는 모아 둔 점수만 와요
+            answers = [{"id": random.choice(QUIZ_IDS), "correct": random.random() < 0.5} for _ in range(5)]
+            call = lambda: http.post("/api/quiz/scores", json={"answers": answers}).raise_for_status()
+
+        started = time.perf_counter()
+        try:
+            call()
+            ok = True
+        except Exception as e:
+            print(f"[{scenario}] 실패: {e}", file=sys.stderr)
+            ok = False
+        recorder.record(scenario, time.perf_counter() - started, ok)
+
+
+def wait_until_ready(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} 이(가) {timeout}초 안에 준비되지 않았어요.")
+
+
+def spawn_stack(args):
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    fake = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "fake_services.py"),
+        "--port", str(args.fake_port),
+        "--latency-ms", str(args.latency_ms),
+        "--jitter-ms", str(args.jitter_ms),
+        "--error-rate", str(args.error_rate),
+        "--throttle-rate", str(args.throttle_rate)
+    ])
+    app = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "run_app.py"),
+        "--fake-url", fake_url,
+        "--port", str(args.app_port)
+    ])
+    wait_until_ready(f"{fake_url}/stats")
+    wait_until_ready(app_url)
+    return app_url, [app, fake]
+
+
+def print_report(report, elapsed, users):
+    print(f"\n동시 사용자 {users}명, {elapsed:.1f}초")
+    print(f"{'시나리오':<8} {'성공':>6} {'실패':>6} {'req/s':>8} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9}")
+    for scenario, row in report.items():
+        print(
+            f"{scenario:<8} {row['ok']:>6} {row['errors']:>6} {row['rps']:>8.2f} "
+            f"{row['p50_ms']:>9.0f} {row['p95_ms']:>9.0f} {row['p99_ms']:>9.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="꼬마환경탐정 부하 테스트")
+    parser.add_argument("--url", default="http://127.0.0.1:7870")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=10, help="사용자 한 명당 요청 수")
+    parser.add_argument("--scenarios", default="image,voice,quiz")
+    parser.add_argument("--unique-images", action="store_true", help="매번 다른 이미지를 올려서 캐시를 피해요")
+    parser.add_argument("--json", help="결과를 JSON 파일로도 저장 (CI 비교용)")
+    parser.add_argument("--spawn", action="store_true", help="가짜 서비스와 앱을 직접 띄워요")
+    parser.add_argument("--fake-port", type=int, default=9100)
+    parser.add_argument("--app-port", type=int, default=7870)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    processes = []
+    url = args.url
+    if args.spawn:
+        url, processes = spawn_stack(args)
+
+    work_dir = tempfile.mkdtemp(prefix="little_detective_load_")
+    voice_sample = make_voice_sample(os.path.join(work_dir, "voice.wav"))
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    recorder = Recorder()
+
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users) as pool:
+            futures = [
+                pool.submit(run_user, url, scenarios, args.requests, recorder, voice_sample, args.unique_images, work_dir)
+                for _ in range(args.users)
+            ]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - started
+    finally:
+        for process in processes:
+            process.terminate()
+
+    report = recorder.summary(elapsed)
+    print_report(report, elapsed, args.users)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"users": args.users, "elapsed": elapsed, "scenarios": report}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# 벤치마크용 앱 실행
+# 모든 클라우드 호출이 bench/fake_services.py 로 가도록 설정해서 main.app 을 띄워요.
+#
+# python bench/run_app.py --fake-url http://127.0.0.1:9100 --port 7870
+
+import argparse
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def configure_environment(fake_url, cache_dir):
+    # main.py 가 읽는 설정은 import 전에 넣어야 해요 (load_dotenv 는 이미 있는 값을 덮어쓰지 않아요)
+    os.environ.update({
+        "AZURE_OPENAI_API_KEY": "fake",
+        "AZURE_OPENAI_VERSION": "2024-06-01",
+        "AZURE_OPENAI_ENDPOINT": fake_url,
+        "CUSTOM_VISION_ENDPOINT": fake_url,
+        "CUSTOM_VISION_KEY": "fake",
+        "CUSTOM_VISION_PROJECT_ID": "fake-project",
+        "CUSTOM_VISION_ITERATION_NAME": "fake-iteration",
+        "STT_BACKEND": "fake",
+        "EXPLANATION_CACHE_DIR": os.path.join(cache_dir, "explanations"),
+        "TTS_CACHE_DIR": os.path.join(cache_dir, "tts"),
+        "SHARED_CACHE_DB": os.path.join(cache_dir, "shared.sqlite3")
+    })
+
+
+# Google 음성 인식 / gTTS 는 주소를 바꿀 수 없어서 가짜 서비스를 부르는 백엔드로 바꿔요
+def install_fake_backends(main, fake_url):
+    import httpx
+
+    http = httpx.Client(base_url=fake_url, timeout=30)
+
+    class FakeRecognizer:
+        def warm_up(self):
+            pass
+
+        def recognize(self, audio):
+            response = http.post("/stt", content=audio.get_wav_data())
+            if response.status_code != 200:
+                raise main.sr.RequestError(f"fake stt {response.status_code}")
+            return response.json()["text"]
+
+    def fake_synthesize_chunk(sentence):
+        response = http.post("/tts", json={"text": sentence, "lang": "ko"})
+        response.raise_for_status()
+        return response.content
+
+    main.SPEECH_BACKENDS["fake"] = FakeRecognizer
+    main.synthesize_chunk = fake_synthesize_chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description="가짜 서비스에 연결된 꼬마환경탐정 앱")
+    parser.add_argument("--fake-url", default="http://127.0.0.1:9100")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7870)
+    parser.add_argument("--cache-dir", default=None, help="비워 두면 매번 새 임시 폴더 (콜드 캐시)")
+    args = parser.parse_args()
+
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix="little_detective_bench_")
+    configure_environment(args.fake_url, cache_dir)
+
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    import main as app_module
+    install_fake_backends(app_module, args.fake_url)
+
+    import uvicorn
+    uvicorn.run(app_module.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
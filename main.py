@@ -5,29 +5,100 @@
 # 3. python main.py
 
 # main.py
+# gradio는 import 할 때 app(gr.Blocks + mount_gradio_app)을 만들어야 해서 바로 불러와요.
+# numpy / PIL도 gradio가 어차피 불러와서 미루지 않아요 (bench/importtime.py 보고서에 따로 나와요)
 import gradio as gr
-import requests
-import openai
-import speech_recognition as sr
-from fastapi import FastAPI
+import httpx
+import importlib
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.datastructures import Headers
+import mimetypes
+import stat
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 from fastapi.staticfiles import StaticFiles
 import os
 import tempfile
-from gtts import gTTS
-from playsound import playsound
 import uuid
 import re
-import emoji
+import json
+import hashlib
+import logging
+import threading
+import io
+import asyncio
+import sqlite3
+import secrets
+import zipfile
+from PIL import Image, UnidentifiedImageError
+import functools
+import contextlib
+import contextvars
+from collections import deque
+import numpy as np
+import random
+import time
+import math
+import unicodedata
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
 load_dotenv()
 
-# Azure OpenAI 설정
-client = openai.AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version=os.getenv("AZURE_OPENAI_VERSION"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-)
+# 무거운 라이브러리는 처음 쓸 때 import 해요 (시작 시간 단축, 시작 후 백그라운드에서 미리 불러와요)
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+openai = LazyModule("openai")
+sr = LazyModule("speech_recognition")
+gtts = LazyModule("gtts")
+emoji = LazyModule("emoji")
+LAZY_MODULES = (openai, sr, gtts, emoji)
+
+logger = logging.getLogger(__name__)
+
+# Azure OpenAI 설정 (클라이언트는 처음 쓸 때 만들어요)
+CHAT_MODEL = "a24-gpt-4o-mini"
+
+# 여러 지역의 배포를 같이 쓸 수 있어요 (JSON 목록, 빠진 값은 AZURE_OPENAI_* 값을 써요)
+# AZURE_OPENAI_DEPLOYMENTS='[{"name": "koreacentral", "endpoint": "https://....openai.azure.com", "api_key": "..."},
+#                            {"name": "japaneast", "endpoint": "https://....openai.azure.com", "api_key": "...", "deployment": "a24-gpt-4o-mini"}]'
+def load_chat_deployment_configs():
+    default = {
+        "name": "default",
+        "endpoint": os.getenv("AZURE_OPENAI_ENDPOINT"),
+        "deployment": CHAT_MODEL,
+        "api_key": os.getenv("AZURE_OPENAI_API_KEY"),
+        "api_version": os.getenv("AZURE_OPENAI_VERSION")
+    }
+    raw = os.getenv("AZURE_OPENAI_DEPLOYMENTS")
+    if not raw:
+        return [default]
+    configs = []
+    for i, entry in enumerate(json.loads(raw)):
+        config = {**default, "name": f"deployment{i}", **entry}
+        if any(c["name"] == config["name"] for c in configs):
+            raise ValueError(f"AZURE_OPENAI_DEPLOYMENTS에 같은 이름이 두 번 있어요: {config['name']}")
+        configs.append(config)
+    if not configs:
+        raise ValueError("AZURE_OPENAI_DEPLOYMENTS가 비어 있어요.")
+    return configs
+
+CHAT_DEPLOYMENT_CONFIGS = load_chat_deployment_configs()
 
 # Custom Vision 설정
 CUSTOM_VISION_ENDPOINT = os.getenv("CUSTOM_VISION_ENDPOINT")
@@ -35,545 +106,2411 @@ CUSTOM_VISION_KEY = os.getenv("CUSTOM_VISION_KEY")
 CUSTOM_VISION_PROJECT_ID = os.getenv("CUSTOM_VISION_PROJECT_ID")
 CUSTOM_VISION_ITERATION_NAME = os.getenv("CUSTOM_VISION_ITERATION_NAME")
 
+# 단계별 타임아웃 (초)
+STT_TIMEOUT = float(os.getenv("STT_TIMEOUT", "10"))
+CHAT_TIMEOUT = float(os.getenv("CHAT_TIMEOUT", "20"))
+TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT", "15"))
+VISION_TIMEOUT = float(os.getenv("VISION_TIMEOUT", "10"))
+
+# Custom Vision 연결 풀 설정
+CUSTOM_VISION_POOL_SIZE = int(os.getenv("CUSTOM_VISION_POOL_SIZE", "32"))
+CUSTOM_VISION_KEEPALIVE = float(os.getenv("CUSTOM_VISION_KEEPALIVE", "60"))
+CUSTOM_VISION_MAX_RETRIES = int(os.getenv("CUSTOM_VISION_MAX_RETRIES", "3"))
+CUSTOM_VISION_BACKOFF = float(os.getenv("CUSTOM_VISION_BACKOFF", "0.3"))
+
+# URL과 헤더는 한 번만 만들어요
+CUSTOM_VISION_URL = f"{CUSTOM_VISION_ENDPOINT}/customvision/v3.0/Prediction/{CUSTOM_VISION_PROJECT_ID}/classify/iterations/{CUSTOM_VISION_ITERATION_NAME}/image"
+CUSTOM_VISION_HEADERS = {
+    "Prediction-Key": CUSTOM_VISION_KEY or "",
+    "Content-Type": "application/octet-stream"
+}
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# keep-alive 연결을 재사용하는 예측용 클라이언트
+prediction_client = httpx.AsyncClient(
+    headers=CUSTOM_VISION_HEADERS,
+    timeout=httpx.Timeout(VISION_TIMEOUT),
+    limits=httpx.Limits(
+        max_connections=CUSTOM_VISION_POOL_SIZE,
+        max_keepalive_connections=CUSTOM_VISION_POOL_SIZE,
+        keepalive_expiry=CUSTOM_VISION_KEEPALIVE
+    )
+)
+
+# 답변을 토큰 단위로 조금씩 보여줄지
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") == "1"
+
+TIMEOUT_MESSAGE = "응답이 너무 늦어지고 있어요. 잠시 후 다시 시도해 주세요."
+CHAT_ERROR_MESSAGE = "답변을 만드는 중 오류가 발생했어요. 잠시 후 다시 시도해 주세요."
+
+# Custom Vision 태그 → 한글 품목명
+tag_kor_map = {
+    'vinyl': '비닐류',
+    'styrofoam': '스티로폼',
+    'glass': '유리병',
+    'clothes': '의류',
+    'paper': '종이류',
+    'can': '캔류',
+    'computer': '컴퓨터',
+    'battery': '폐건전지',
+    'fluorescentlamp': '폐형광등',
+    'plastic': '플라스틱류'
+}
+
+# 음성 질문 시스템 프롬프트
+VOICE_SYSTEM_PROMPT = "친절한 분리수거 안내 도우미입니다. 어린이들을 대상으로 알려주는 거니까 이모티콘 많이 섞어서 답변해주세요."
+
+# 품목 설명 프롬프트 (바뀌면 캐시가 자동으로 무효화돼요)
+EXPLAIN_SYSTEM_PROMPT = "친절한 분리수거 안내 도우미입니다."
+EXPLAIN_PROMPT_TEMPLATE = "'{tag_kor}'는 어떤 재활용 품목인가요? 어떻게 분리배출해야 하나요? 어린이를 위한 거니까 이모티콘 많이 섞어서, 친절하게 설명해줘."
+
+# 업로드 이미지 인코딩 설정
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1024"))
+
+# 설명 + mp3 캐시 설정
+EXPLANATION_CACHE_DIR = os.getenv("EXPLANATION_CACHE_DIR", ".cache/explanations")
+WARM_EXPLANATION_CACHE = os.getenv("WARM_EXPLANATION_CACHE", "1") == "1"
+
+# 단계별 지연 시간 히스토그램 / 카운터 (Prometheus 텍스트 형식으로 /metrics에 내보내요)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 지금 어떤 핸들러 안에서 도는지 (voice / image / batch / warmup)
+current_handler = contextvars.ContextVar("current_handler", default="none")
+
+# 라벨 값의 \, ", 줄바꿈은 Prometheus 형식대로 이스케이프해요
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (단계, 핸들러) → [버킷별 개수..., 합계, 개수]
+        self.counters = {}  # (이름, 라벨) → 값
+
+    def observe(self, stage, handler, seconds):
+        with self.lock:
+            values = self.histograms.setdefault((stage, handler), [0] * len(LATENCY_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    values[i] += 1
+            values[-2] += seconds
+            values[-1] += 1
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def render(self):
+        lines = [
+            "# HELP little_detective_stage_seconds Latency of each pipeline stage.",
+            "# TYPE little_detective_stage_seconds histogram"
+        ]
+        with self.lock:
+            for (stage, handler), values in sorted(self.histograms.items()):
+                labels = f'stage="{escape_label(stage)}",handler="{escape_label(handler)}"'
+                for bound, count in zip(LATENCY_BUCKETS, values):
+                    lines.append(f'little_detective_stage_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'little_detective_stage_seconds_bucket{{{labels},le="+Inf"}} {values[-1]}')
+                lines.append(f"little_detective_stage_seconds_sum{{{labels}}} {values[-2]}")
+                lines.append(f"little_detective_stage_seconds_count{{{labels}}} {values[-1]}")
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f"# TYPE {name} counter")
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        label_text = ",".join(f'{k}="{escape_label(v)}"' for k, v in labels)
+                        lines.append(f"{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# with timed("chat"): ... 처럼 감싸면 걸린 시간과 에러를 기록해요
+@contextlib.contextmanager
+def timed(stage, handler=None):
+    handler = handler or current_handler.get()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        metrics.inc("little_detective_errors_total", stage=stage, handler=handler, error=type(e).__name__)
+        raise
+    finally:
+        metrics.observe(stage, handler, time.perf_counter() - started)
+
+# 업스트림별 차단기 설정
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))  # 최근 몇 번의 호출을 볼지
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_RATIO = float(os.getenv("BREAKER_SLOW_RATIO", "0.5"))  # 타임아웃의 이 비율보다 느리면 실패로 쳐요
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "1"))
+
+class CircuitOpen(Exception):
+    pass
+
+circuit_breakers = {}  # 이름 → CircuitBreaker
+
+# 최근 호출 중 실패(에러 또는 너무 느림)가 많으면 잠시 열려서(open) 부르지 않고 바로 CircuitOpen을 던져요
+# 시간이 지나면 반쯤 열어서(half_open) 몇 번만 시험해 보고, 잘 되면 다시 닫아요(closed)
+class CircuitBreaker:
+    STATES = {"closed": 0, "open": 1, "half_open": 2}
+
+    def __init__(self, name, slow_seconds):
+        self.name = name
+        self.slow_seconds = slow_seconds
+        self.state = "closed"
+        self.results = deque(maxlen=BREAKER_WINDOW)  # True면 실패
+        self.opened_at = 0.0
+        self.probes = 0
+        self.probe_successes = 0
+        self.short_circuited = 0
+        circuit_breakers[name] = self
+
+    def _set_state(self, state):
+        self.state = state
+        self.probes = 0
+        self.probe_successes = 0
+        if state == "open":
+            self.opened_at = time.monotonic()
+            logger.warning("%s 차단기가 열렸어요", self.name)
+        self.results.clear()
+        metrics.inc("little_detective_breaker_transitions_total", upstream=self.name, state=state)
+
+    # 상태를 바꾸지 않고 지금 부를 수 있는지만 봐요 (배포 고를 때)
+    def available(self):
+        if self.state == "open":
+            return time.monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS
+        if self.state == "half_open":
+            return self.probes < BREAKER_HALF_OPEN_PROBES
+        return True
+
+    def allow(self):
+        if self.state == "open" and time.monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS:
+            self._set_state("half_open")
+        if self.state == "half_open" and self.probes < BREAKER_HALF_OPEN_PROBES:
+            self.probes += 1
+            return True
+        if self.state == "closed":
+            return True
+        self.short_circuited += 1
+        metrics.inc("little_detective_breaker_short_circuits_total", upstream=self.name)
+        return False
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpen(self.name)
+
+    def record(self, ok, seconds=0.0):
+        failed = not ok or seconds > self.slow_seconds
+        if self.state == "half_open":
+            if failed:
+                self._set_state("open")
+                return
+            self.probe_successes += 1
+            if self.probe_successes >= BREAKER_HALF_OPEN_PROBES:
+                self._set_state("closed")
+            return
+        if self.state != "closed":
+            return
+        self.results.append(failed)
+        if len(self.results) >= BREAKER_MIN_CALLS and sum(self.results) / len(self.results) >= BREAKER_ERROR_RATE:
+            self._set_state("open")
+
+    # 결과를 모르고 끝났을 때(취소 등) 시험 자리만 돌려줘요
+    def cancel(self):
+        if self.state == "half_open" and self.probes > 0:
+            self.probes -= 1
+
+    # ignore에 있는 예외는 업스트림 문제가 아니라서 성공으로 쳐요 (예: 말을 못 알아들음)
+    async def call(self, fn, ignore=()):
+        self.check()
+        started = time.monotonic()
+        try:
+            result = await fn()
+        except Exception as e:
+            self.record(isinstance(e, ignore), time.monotonic() - started)
+            raise
+        except BaseException:
+            self.cancel()
+            raise
+        self.record(True, time.monotonic() - started)
+        return result
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "recent_calls": len(self.results),
+            "recent_failures": sum(self.results),
+            "short_circuited": self.short_circuited,
+            "open_seconds_left": max(0.0, self.opened_at + BREAKER_OPEN_SECONDS - time.monotonic()) if self.state == "open" else 0.0
+        }
+
 # 이모지 빼고 tts에 넘겨주는 함수
 def remove_emojis(text):
     return emoji.replace_emoji(text, replace='')  # 이모지를 공백으로 대체
 
-# tts 기능
-def text_to_speech(text: str):
+# 다른 이름으로 다 쓴 다음에 바꿔서 반쯤 쓰인 파일이 보이지 않게 해요
+def write_atomic(path, data):
+    part_path = f"{path}.{uuid.uuid4().hex}.part"
+    with open(part_path, "wb") as f:
+        f.write(data)
+    os.replace(part_path, path)
+
+# 예전 버전은 답변마다 /tmp/<uuid>.mp3를 만들고 지우지 않았어요 (한 번만 정리해요)
+LEGACY_TTS_DIR = "/tmp"
+LEGACY_TTS_PATTERN = re.compile(r"^[0-9a-f]{32}\.mp3$")
+LEGACY_TTS_MIN_AGE = 3600
+
+def sweep_legacy_tts_files(marker_dir):
+    marker = os.path.join(marker_dir, ".legacy_swept")
+    if os.path.exists(marker) or not os.path.isdir(LEGACY_TTS_DIR):
+        return
+    removed = 0
+    for entry in os.scandir(LEGACY_TTS_DIR):
+        if not LEGACY_TTS_PATTERN.match(entry.name):
+            continue
+        try:
+            if entry.is_file(follow_symlinks=False) and time.time() - entry.stat().st_mtime > LEGACY_TTS_MIN_AGE:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            pass
+    os.makedirs(marker_dir, exist_ok=True)
+    write_atomic(marker, b"")
+    logger.info("예전 TTS 파일 %d개를 지웠어요", removed)
+
+# TTS mp3 저장소 설정
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "little_detective_tts"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_MB", "200")) * 1024 * 1024
+TTS_CACHE_MAX_AGE = float(os.getenv("TTS_CACHE_MAX_AGE_HOURS", "72")) * 3600
+
+# 같은 문장은 같은 파일 이름(내용 해시)을 써서 한 번만 합성해요
+# 용량/사용 안 한 기간을 넘으면 오래 안 쓴 파일부터 지워요 (LRU)
+class TTSStore:
+    NAME_PATTERN = re.compile(r"^[0-9a-f]{64}\.mp3$")
+    PART_PATTERN = re.compile(r"^[0-9a-f]{64}\.mp3\.[0-9a-f]{32}\.part$")
+
+    def __init__(self, directory, max_bytes, max_age):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # 파일 이름 → (크기, 마지막 사용 시각)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, clean_text, lang):
+        return hashlib.sha256(f"{lang}\n{clean_text}".encode("utf-8")).hexdigest() + ".mp3"
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def get(self, name):
+        with self.lock:
+            try:
+                size = os.path.getsize(self.path(name))
+            except OSError:
+                size = None
+            if size is not None:
+                # 다른 워커 프로세스가 만든 파일도 같이 써요
+                # 마지막 사용 시각은 파일 수정 시각에 남겨서 모든 워커가 같은 LRU 순서를 봐요
+                now = time.time()
+                try:
+                    os.utime(self.path(name), (now, now))
+                except OSError:
+                    pass
+                if name in self.entries:
+                    self.bytes -= self.entries.pop(name)[0]
+                self.entries[name] = (size, now)
+                self.bytes += size
+                self.hits += 1
+                return self.path(name)
+            if name in self.entries:
+                self.bytes -= self.entries.pop(name)[0]
+            self.misses += 1
+            return None
+
+    def put(self, name, audio):
+        os.makedirs(self.directory, exist_ok=True)
+        write_atomic(self.path(name), audio)
+        # 용량 한도는 모든 워커가 같이 쓰는 폴더 기준이라서, 폴더를 다시 읽고 지워요
+        with self.lock:
+            self._rescan()
+            self._evict()
+        return self.path(name)
+
+    def _rescan(self):
+        found = []
+        for entry in os.scandir(self.directory):
+            if not self.NAME_PATTERN.match(entry.name):
+                continue
+            try:
+                info = entry.stat()
+            except OSError:
+                continue
+            found.append((info.st_mtime, entry.name, info.st_size))
+        self.entries.clear()
+        self.bytes = 0
+        for mtime, name, size in sorted(found):
+            self.entries[name] = (size, mtime)
+            self.bytes += size
+
+    def _evict(self):
+        now = time.time()
+        while self.entries:
+            name, (size, last_used) = next(iter(self.entries.items()))
+            if self.bytes <= self.max_bytes and now - last_used <= self.max_age:
+                break
+            self.entries.pop(name)
+            self.bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path(name))
+            except OSError:
+                pass
+
+    # 시작할 때 남아 있는 파일을 읽어 들이고, 쓰다 만 파일(.part)은 지워요
+    # 다른 프로그램 파일이 있을 수 있어서(TTS_CACHE_DIR=/tmp 등) 이 저장소 이름 규칙에 맞는 것만 건드려요
+    def sweep(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for entry in os.scandir(self.directory):
+            if not self.PART_PATTERN.match(entry.name):
+                continue
+            try:
+                if time.time() - entry.stat().st_mtime > 60:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+        with self.lock:
+            self._rescan()
+            self._evict()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "files": len(self.entries),
+                "bytes": self.bytes
+            }
+
+tts_store = TTSStore(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES, TTS_CACHE_MAX_AGE)
+
+# 문장 단위로 나눠서 동시에 합성하는 TTS 작업자 풀
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "4"))
+TTS_MIN_CHUNK_LENGTH = int(os.getenv("TTS_MIN_CHUNK_LENGTH", "20"))
+tts_pool = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+
+# 마침표/물음표/느낌표/물결/줄바꿈 뒤에서 문장을 나눠요
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?。…~])\s+|\n+')
+
+# 너무 짧은 문장은 앞 문장에 붙여서 요청 수를 줄여요
+def split_sentences(text):
+    chunks = []
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if chunks and len(chunks[-1]) < TTS_MIN_CHUNK_LENGTH:
+            chunks[-1] += " " + sentence
+        else:
+            chunks.append(sentence)
+    return chunks or [text]
+
+def synthesize_chunk(sentence):
+    buffer = io.BytesIO()
+    gtts.gTTS(sentence, lang='ko').write_to_fp(buffer)
+    return buffer.getvalue()
+
+# tts 기능 (문장별 mp3를 순서대로 이어 붙여서 한 번에 저장)
+# path를 주지 않으면 TTS 저장소에 내용 해시 이름으로 저장해요
+def text_to_speech(text: str, path=None):
     clean_text = remove_emojis(text)
-    tmp_path = f"/tmp/{uuid.uuid4().hex}.mp3"
-    tts = gTTS(clean_text, lang='ko')
-    tts.save(tmp_path)
-    return tmp_path
-
-# 음성 인식 함수
-def handle_voice_input(audio_path):
-    recognizer = sr.Recognizer()
-    with sr.AudioFile(audio_path) as source:
-        audio = recognizer.record(source)
+    if path is None:
+        name = tts_store.key(clean_text, "ko")
+        cached_path = tts_store.get(name)
+        if cached_path:
+            return cached_path
+
+    audio = b"".join(tts_pool.map(synthesize_chunk, split_sentences(clean_text)))
+    if path is None:
+        return tts_store.put(name, audio)
+    write_atomic(path, audio)
+    return path
+
+# 똑같은 업스트림 요청이 동시에 여러 개 오면 하나만 보내고 결과(에러 포함)를 같이 써요
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.flights = {}
+
+    async def do(self, key, fn):
+        future = self.flights.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self.flights[key] = future
+            future.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            metrics.inc("little_detective_coalesced_total", upstream=self.name)
+        # 한 명이 나가도(취소돼도) 다른 사람 요청은 계속돼요
+        return await asyncio.shield(future)
+
+    def _finish(self, key, future):
+        self.flights.pop(key, None)
+        if not future.cancelled():
+            future.exception()  # 기다리던 사람이 모두 나갔어도 경고가 안 나게 꺼내 둬요
+
+# 스트리밍 답변을 여러 명이 같이 받아요 (값은 지금까지의 답변 전체라서 최신 값만 있으면 돼요)
+class SharedStream:
+    def __init__(self):
+        self.latest = None
+        self.version = 0
+        self.finished = False
+        self.error = None
+        self.event = asyncio.Event()
+        self.subscribers = 0  # 지금 받아보는 사람 수 (0이 되면 task를 멈춰요)
+        self.task = None
+
+    def publish(self, text):
+        self.latest = text
+        self.version += 1
+        self._wake()
+
+    def finish(self, error=None):
+        self.finished = True
+        self.error = error
+        self._wake()
+
+    def _wake(self):
+        self.event.set()
+        self.event = asyncio.Event()
+
+    async def subscribe(self):
+        seen = 0
+        while True:
+            if self.version > seen:
+                seen = self.version
+                yield self.latest
+            elif self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self.event.wait()
+
+tts_flights = SingleFlight("tts")
+chat_streams = {}  # 요청 키 → SharedStream
+
+def upstream_key(*parts):
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+tts_breaker = CircuitBreaker("tts", TTS_TIMEOUT * BREAKER_SLOW_RATIO)
+
+# gTTS는 동기 라이브러리라서 스레드에서 돌려요
+async def text_to_speech_async(text: str, path=None):
+    key = upstream_key(remove_emojis(text), "ko", path)
 
+    # 같이 기다리는 사람이 여럿이어도 실제 호출 한 번만 차단기와 지연 시간에 기록해요
+    async def call():
+        with timed("tts"):
+            return await asyncio.wait_for(asyncio.to_thread(text_to_speech, text, path), TTS_TIMEOUT)
+    return await tts_flights.do(key, lambda: tts_breaker.call(call))
+
+# 음성이 없어도 글 답변은 보여줘요
+# (gTTS 429 / 네트워크 오류도 여기서 멈춰요)
+async def text_to_speech_or_none(text: str, path=None):
     try:
-        user_text = recognizer.recognize_google(audio, language="ko-KR")
-    except sr.UnknownValueError:
-        return "음성을 인식하지 못했어요. 다시 말씀해 주세요.", None
-    except sr.RequestError:
-        return "음성 인식 서비스에 문제가 발생했어요.", None
+        return await text_to_speech_async(text, path)
+    except (asyncio.TimeoutError, CircuitOpen):
+        return None
+    except Exception:
+        logger.exception("음성 합성 실패")
+        return None
+
+# 토큰이 도착할 때마다 지금까지의 답변 전체를 내보내요
+# 같은 모델 + 같은 메시지 요청이 이미 진행 중이면 그 스트림을 같이 받아요
+async def stream_chat(messages):
+    key = upstream_key(CHAT_MODEL, messages)
+    shared = chat_streams.get(key)
+    if shared is None:
+        shared = chat_streams[key] = SharedStream()
+
+        async def lead():
+            try:
+                async for text in stream_chat_upstream(messages):
+                    shared.publish(text)
+            except BaseException as e:
+                shared.finish(e if isinstance(e, Exception) else asyncio.CancelledError())
+                raise
+            else:
+                shared.finish()
+            finally:
+                if chat_streams.get(key) is shared:
+                    chat_streams.pop(key, None)
+
+        shared.task = asyncio.ensure_future(lead())
+        shared.task.add_done_callback(lambda done: done.cancelled() or done.exception())
+    else:
+        metrics.inc("little_detective_coalesced_total", upstream="chat")
+
+    # 마지막 사람이 나가면(창 닫기, 새 질문) 아무도 안 보는 답변을 끝까지 받지 않게 멈춰요
+    shared.subscribers += 1
+    try:
+        async for text in shared.subscribe():
+            yield text
+    finally:
+        shared.subscribers -= 1
+        if shared.subscribers == 0 and not shared.task.done():
+            if chat_streams.get(key) is shared:
+                chat_streams.pop(key, None)  # 새로 온 사람은 멈춘 흐름 대신 새로 시작해요
+            shared.task.cancel()
+
+# 배포의 호출 한도(limiter) 차례를 받은 뒤에 Azure를 불러요
+# 429를 받으면 한도를 줄이고, 기다렸다가 대기열을 다시 거쳐서 재시도해요
+async def stream_deployment(deployment, messages):
+    tokens = estimate_chat_tokens(messages)
+    breaker = deployment.breaker
+    for attempt in range(CHAT_MAX_RETRIES + 1):
+        breaker.check()
+        waited = time.perf_counter()
+        try:
+            await deployment.limiter.acquire(tokens)
+        except BaseException:
+            breaker.cancel()
+            raise
+        metrics.observe("chat_limit_wait", current_handler.get(), time.perf_counter() - waited)
+        text = ""
+        first_token = None
+        started = time.perf_counter()
+        try:
+            with timed("chat"):
+                response = await asyncio.wait_for(
+                    deployment.get_client().chat.completions.with_raw_response.create(
+                        model=deployment.model, messages=messages, stream=True, timeout=CHAT_TIMEOUT
+                    ),
+                    CHAT_TIMEOUT
+                )
+                deployment.limiter.update(response.headers)
+                chunks = response.parse().__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), CHAT_TIMEOUT)
+                    except StopAsyncIteration:
+                        break
+                    # Azure는 내용 없는 청크(콘텐츠 필터 결과 등)도 보내요
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                            metrics.observe("chat_first_token", current_handler.get(), first_token)
+                            deployment.observe_first_token(first_token)
+                        text += chunk.choices[0].delta.content
+                        yield text
+        except openai.RateLimitError as e:
+            # 429는 limiter가 맡아요 (차단기는 죽은 업스트림만 봐요)
+            breaker.cancel()
+            deployment.limiter.release(throttled=True, headers=e.response.headers)
+            deployment.observe_result(False)
+            # 이미 일부를 보냈으면 다시 처음부터 보낼 수 없어요
+            if text or attempt == CHAT_MAX_RETRIES:
+                raise
+            continue
+        except Exception:
+            breaker.record(False)
+            deployment.limiter.release()
+            deployment.observe_result(False)
+            raise
+        except BaseException:
+            # 헤지에서 져서 취소됐으면 첫 토큰까지 최소 이만큼 걸린 거예요
+            if first_token is None:
+                first_token = time.perf_counter() - started
+                deployment.observe_first_token(first_token)
+            breaker.record(True, first_token)
+            deployment.limiter.release()
+            raise
+        breaker.record(True, first_token if first_token is not None else time.perf_counter() - started)
+        deployment.limiter.release(succeeded=True)
+        deployment.observe_result(True)
+        return
+
+# 가중치로 고른 배포에 먼저 보내고, 그 배포의 평소 첫 토큰 시간(p95)이 지나도 답이 없으면
+# 다음 배포에도 같은 요청을 보내서(헤지) 먼저 첫 토큰을 보낸 쪽을 써요
+# 첫 토큰 전에 실패하면 다음 배포로 넘어가요
+async def stream_chat_upstream(messages):
+    candidates = route_chat_deployments()
+    attempts = {}  # 첫 토큰을 기다리는 태스크 → (배포, 스트림)
+
+    def start(deployment):
+        stream = stream_deployment(deployment, messages)
+        attempts[asyncio.ensure_future(stream.__anext__())] = (deployment, stream)
+        return time.monotonic() + deployment.hedge_delay()
+
+    async def cancel_attempts():
+        for task in attempts:
+            task.cancel()
+        await asyncio.gather(*attempts, return_exceptions=True)
+        for _, stream in attempts.values():
+            await stream.aclose()
+        attempts.clear()
+
+    primary = candidates.pop(0)
+    hedge_at = start(primary)
+    hedged = False
+    error = None
+    winner = None
+    try:
+        while winner is None:
+            if not attempts:
+                if not candidates:
+                    raise error
+                hedge_at = start(candidates.pop(0))
+            can_hedge = CHAT_HEDGE and not hedged and candidates
+            timeout = max(0.0, hedge_at - time.monotonic()) if can_hedge else None
+            done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                metrics.inc("little_detective_chat_hedged_total")
+                start(candidates.pop(0))
+                continue
+            for task in done:
+                deployment, stream = attempts.pop(task)
+                try:
+                    winner = deployment, stream, task.result()
+                    break
+                except StopAsyncIteration:
+                    winner = deployment, stream, None
+                    break
+                except Exception as e:
+                    error = e
+        await cancel_attempts()
+    finally:
+        await cancel_attempts()
+
+    deployment, stream, text = winner
+    # 헤지를 띄웠어도 첫 배포가 이기면 헤지 덕분이 아니에요
+    if hedged and deployment is not primary:
+        deployment.hedge_wins += 1
+        metrics.inc("little_detective_chat_hedge_wins_total", deployment=deployment.name)
+    if text is None:
+        return
+    try:
+        yield text
+        async for text in stream:
+            yield text
+    finally:
+        await stream.aclose()
+
+# 모델 / 프롬프트가 바뀌면 버전도 바뀌어요
+def explanation_prompt_version():
+    raw = "\n".join([CHAT_MODEL, EXPLAIN_SYSTEM_PROMPT, EXPLAIN_PROMPT_TEMPLATE])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+def explanation_cache_path(tag):
+    key = hashlib.sha256(f"{tag}\n{explanation_prompt_version()}".encode("utf-8")).hexdigest()[:24]
+    return os.path.join(EXPLANATION_CACHE_DIR, key + ".json")
+
+# mp3 이름은 설명 글의 해시라서, 설명이 새로 만들어지면 mp3도 새 글로 따로 생겨요
+def explanation_audio_path(text):
+    key = hashlib.sha256(text.encode("utf-8")).hexdigest()[:24]
+    return os.path.join(EXPLANATION_CACHE_DIR, key + ".mp3")
+
+def explanation_messages(tag):
+    tag_kor = tag_kor_map.get(tag, tag)
+    return [
+        {"role": "system", "content": EXPLAIN_SYSTEM_PROMPT},
+        {"role": "user", "content": EXPLAIN_PROMPT_TEMPLATE.format(tag_kor=tag_kor)}
+    ]
+
+def load_cached_explanation(tag):
+    json_path = explanation_cache_path(tag)
+    try:
+        with open(json_path, encoding="utf-8") as f:
+            return json.load(f)["text"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save_cached_explanation(tag, explanation):
+    json_path = explanation_cache_path(tag)
+    os.makedirs(EXPLANATION_CACHE_DIR, exist_ok=True)
+    entry = {"tag": tag, "version": explanation_prompt_version(), "text": explanation}
+    write_atomic(json_path, json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+
+# Azure OpenAI를 못 쓸 때 보여줄 설명
+CANNED_EXPLANATION = "{tag_kor}은(는) 안에 든 것을 비우고 깨끗하게 해서 분리수거함에 넣어 주세요! ♻️ 자세한 방법은 조금 뒤에 다시 알려 줄게요 😊"
+
+# 프롬프트 버전이 달라도 같은 태그의 가장 최근 설명을 찾아요 (없으면 준비된 문구)
+def fallback_explanation(tag):
+    newest = None
+    if os.path.isdir(EXPLANATION_CACHE_DIR):
+        for entry in os.scandir(EXPLANATION_CACHE_DIR):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                with open(entry.path, encoding="utf-8") as f:
+                    cached = json.load(f)
+                mtime = entry.stat().st_mtime
+            except (OSError, ValueError):
+                continue
+            if cached.get("tag") == tag and cached.get("text") and (newest is None or mtime > newest[0]):
+                newest = (mtime, cached["text"])
+    if newest is not None:
+        metrics.inc("little_detective_degraded_total", upstream="chat", fallback="stale_explanation")
+        return newest[1]
+    metrics.inc("little_detective_degraded_total", upstream="chat", fallback="canned")
+    return CANNED_EXPLANATION.format(tag_kor=tag_kor_map.get(tag, tag))
+
+# 태그별 설명과 mp3를 캐시에서 꺼내고, 없으면 스트리밍으로 만들어서 저장
+# (설명, None)을 여러 번 내보낸 뒤 마지막에 (설명, mp3 경로)를 내보내요
+# 차단기가 열려 있으면 옛날 설명이나 준비된 문구를 주고, 음성을 못 만들면 mp3 경로는 None이에요
+async def stream_explanation(tag):
+    explanation = load_cached_explanation(tag)
+    metrics.inc("little_detective_cache_requests_total", cache="explanation", result="miss" if explanation is None else "hit")
+
+    if explanation is None:
+        explanation = ""
+        try:
+            async for explanation in stream_chat(explanation_messages(tag)):
+                yield explanation, None
+        except CircuitOpen:
+            # 대신 주는 설명은 캐시에 저장하지 않아요
+            explanation = fallback_explanation(tag)
+            yield explanation, await text_to_speech_or_none(explanation)
+            return
+        explanation = explanation.strip()
+        save_cached_explanation(tag, explanation)
+
+    mp3_path = explanation_audio_path(explanation)
+    if not os.path.exists(mp3_path):
+        mp3_path = await text_to_speech_or_none(explanation, path=mp3_path)
+
+    yield explanation, mp3_path
+
+async def get_explanation(tag):
+    async for explanation, mp3_path in stream_explanation(tag):
+        pass
+    return explanation, mp3_path
+
+# 프롬프트 버전이 다른 옛날 캐시는 지워요
+# (새 버전 설명이 아직 없는 태그는 Azure OpenAI가 멈췄을 때 쓰려고 남겨 둬요)
+# 남은 설명 어느 것의 글과도 맞지 않는 mp3도 지워요
+def prune_explanation_cache():
+    if not os.path.isdir(EXPLANATION_CACHE_DIR):
+        return
+    version = explanation_prompt_version()
+    entries = {}
+    for name in os.listdir(EXPLANATION_CACHE_DIR):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(EXPLANATION_CACHE_DIR, name)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entries[path] = json.load(f)
+        except (OSError, ValueError):
+            entries[path] = None
+    current_tags = {entry.get("tag") for entry in entries.values() if entry and entry.get("version") == version}
+    kept_audio = set()
+    for path, entry in entries.items():
+        stale = entry is None or (entry.get("version") != version and entry.get("tag") in current_tags)
+        if stale:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        elif isinstance(entry.get("text"), str):
+            kept_audio.add(os.path.basename(explanation_audio_path(entry["text"])))
+    for name in os.listdir(EXPLANATION_CACHE_DIR):
+        if name.endswith(".mp3") and name not in kept_audio:
+            try:
+                os.remove(os.path.join(EXPLANATION_CACHE_DIR, name))
+            except OSError:
+                pass
+
+# 다른 프로세스가 잡고 있으면 기다리지 않고 False를 내줘요 (프로세스가 죽으면 OS가 풀어줘요)
+@contextlib.contextmanager
+def try_file_lock(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+# 시작할 때 열 가지 태그 설명을 미리 만들어 둬요
+# 워커가 여럿이면 잠금을 잡은 하나만 만들고, 나머지는 같은 캐시 폴더에서 읽어요
+async def warm_explanation_cache():
+    current_handler.set("warmup")
+    with try_file_lock(os.path.join(EXPLANATION_CACHE_DIR, ".warmup.lock")) as locked:
+        if not locked:
+            logger.info("다른 워커가 설명 캐시를 준비하고 있어요")
+            return
+        prune_explanation_cache()
+        for tag in tag_kor_map:
+            try:
+                await get_explanation(tag)
+            except Exception:
+                logger.exception("설명 캐시 준비 실패: %s", tag)
+
+# 음성 인식 백엔드 설정 (google | vosk | whisper)
+STT_BACKEND = os.getenv("STT_BACKEND", "google")
+STT_MODEL_PATH = os.getenv("STT_MODEL_PATH")
+STT_WORKERS = int(os.getenv("STT_WORKERS", "0")) or (16 if STT_BACKEND == "google" else os.cpu_count() or 1)
+stt_pool = ThreadPoolExecutor(max_workers=STT_WORKERS, thread_name_prefix="stt")
+
+# 모든 백엔드는 sr.AudioData를 받아서 글자를 돌려주고,
+# 못 알아들으면 sr.UnknownValueError, 서비스 문제면 sr.RequestError를 던져요
+class GoogleRecognizer:
+    def warm_up(self):
+        pass
+
+    def recognize(self, audio):
+        return sr.Recognizer().recognize_google(audio, language="ko-KR")
+
+# 네트워크 없이 CPU에서 도는 Vosk 한국어 모델
+class VoskRecognizer:
+    def __init__(self, model_path):
+        import vosk
+        vosk.SetLogLevel(-1)
+        self.vosk = vosk
+        self.model = vosk.Model(model_path)
+
+    def warm_up(self):
+        silence = sr.AudioData(b"\0\0" * 16000, 16000, 2)
+        try:
+            self.recognize(silence)
+        except sr.UnknownValueError:
+            pass
+
+    def recognize(self, audio):
+        recognizer = self.vosk.KaldiRecognizer(self.model, 16000)
+        recognizer.AcceptWaveform(audio.get_raw_data(convert_rate=16000, convert_width=2))
+        text = json.loads(recognizer.FinalResult()).get("text", "").strip()
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+# faster-whisper (whisper.cpp처럼 int8로 CPU에서 돌아요)
+class WhisperRecognizer:
+    def __init__(self, model_path):
+        from faster_whisper import WhisperModel
+        self.model = WhisperModel(model_path or "small", device="cpu", compute_type="int8", cpu_threads=1)
+
+    def warm_up(self):
+        silence = sr.AudioData(b"\0\0" * 16000, 16000, 2)
+        try:
+            self.recognize(silence)
+        except sr.UnknownValueError:
+            pass
+
+    def recognize(self, audio):
+        pcm = audio.get_raw_data(convert_rate=16000, convert_width=2)
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        segments, _ = self.model.transcribe(samples, language="ko", beam_size=1, vad_filter=True)
+        text = "".join(segment.text for segment in segments).strip()
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+SPEECH_BACKENDS = {
+    "google": lambda: GoogleRecognizer(),
+    "vosk": lambda: VoskRecognizer(STT_MODEL_PATH),
+    "whisper": lambda: WhisperRecognizer(STT_MODEL_PATH)
+}
 
-    response = client.chat.completions.create(
-        model="a24-gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "친절한 분리수거 안내 도우미입니다. 어린이들을 대상으로 알려주는 거니까 이모티콘 많이 섞어서 답변해주세요."},
-            {"role": "user", "content": user_text}
-        ]
-    )
+_speech_backend = None
+_speech_backend_lock = threading.Lock()
+
+# 모델은 프로세스에서 한 번만 읽어서 모든 요청이 같이 써요
+def get_speech_backend():
+    global _speech_backend
+    with _speech_backend_lock:
+        if _speech_backend is None:
+            if STT_BACKEND not in SPEECH_BACKENDS:
+                raise ValueError(f"알 수 없는 STT_BACKEND: {STT_BACKEND}")
+            _speech_backend = SPEECH_BACKENDS[STT_BACKEND]()
+        return _speech_backend
+
+def warm_up_speech_backend():
+    try:
+        get_speech_backend().warm_up()
+    except Exception:
+        logger.exception("음성 인식 모델 준비 실패")
+
+# 녹음 전처리 설정
+STT_SAMPLE_RATE = 16000
+STT_MAX_SECONDS = float(os.getenv("STT_MAX_SECONDS", "15"))
+VAD_FRAME_MS = 20
+VAD_PADDING_MS = int(os.getenv("VAD_PADDING_MS", "200"))
+VAD_MIN_DBFS = float(os.getenv("VAD_MIN_DBFS", "-45"))
+RESAMPLE_FILTER_TAPS = 63
+
+# 샘플레이트를 낮추기 전에 새 나이퀴스트 주파수 위의 소리를 걸러요 (안 그러면 접혀서 잡음이 돼요)
+# Hamming 창을 씌운 windowed-sinc 저역 통과 필터예요
+def lowpass_for_resample(samples, source_rate, target_rate):
+    # 원래 샘플레이트 기준 비율이에요 (새 나이퀴스트는 0.5 * target / source, 전이 구간만큼 조금 낮게 잡아요)
+    cutoff = 0.45 * target_rate / source_rate
+    n = np.arange(RESAMPLE_FILTER_TAPS) - (RESAMPLE_FILTER_TAPS - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(RESAMPLE_FILTER_TAPS)
+    taps /= taps.sum()
+    return np.convolve(samples, taps.astype(np.float32), mode="same")
+
+# 16kHz 모노로 바꾸고, 앞뒤 무음은 잘라내고, 너무 긴 녹음은 앞부분만 써요
+def preprocess_audio(audio):
+    samples = np.frombuffer(audio.get_raw_data(convert_width=2), dtype=np.int16).astype(np.float32) / 32768.0
+    if audio.sample_rate != STT_SAMPLE_RATE and len(samples):
+        if audio.sample_rate > STT_SAMPLE_RATE:
+            samples = lowpass_for_resample(samples, audio.sample_rate, STT_SAMPLE_RATE)
+        duration = len(samples) / audio.sample_rate
+        target = np.arange(int(duration * STT_SAMPLE_RATE)) / STT_SAMPLE_RATE
+        source = np.arange(len(samples)) / audio.sample_rate
+        samples = np.interp(target, source, samples).astype(np.float32)
+
+    # 프레임별 에너지(dBFS)로 말소리 구간을 찾아요
+    frame = STT_SAMPLE_RATE * VAD_FRAME_MS // 1000
+    frame_count = len(samples) // frame
+    if frame_count == 0:
+        raise sr.UnknownValueError()
+    frames = samples[:frame_count * frame].reshape(frame_count, frame)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    # 배경 소음보다 충분히 크고, 절대 기준보다도 커야 말소리로 봐요
+    threshold = max(np.percentile(energy_db, 10) + 10, VAD_MIN_DBFS)
+    voiced = np.flatnonzero(energy_db > threshold)
+    if len(voiced) == 0:
+        raise sr.UnknownValueError()
+
+    padding = VAD_PADDING_MS // VAD_FRAME_MS
+    start = max(voiced[0] - padding, 0) * frame
+    end = min(voiced[-1] + 1 + padding, frame_count) * frame
+    end = min(end, start + int(STT_MAX_SECONDS * STT_SAMPLE_RATE))
+
+    pcm = (np.clip(samples[start:end], -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+    return sr.AudioData(pcm, STT_SAMPLE_RATE, 2)
+
+stt_breaker = CircuitBreaker("stt", STT_TIMEOUT * BREAKER_SLOW_RATIO)
+
+def recognize_speech(audio_path):
+    with sr.AudioFile(audio_path) as source:
+        audio = sr.Recognizer().record(source)
+    with timed("audio_preprocess", handler="voice"):
+        audio = preprocess_audio(audio)
+    return get_speech_backend().recognize(audio)
+
+# 음성 질문 답변 캐시 설정
+VOICE_CACHE_SIZE = int(os.getenv("VOICE_CACHE_SIZE", "512"))
+VOICE_CACHE_TTL = float(os.getenv("VOICE_CACHE_TTL_HOURS", "24")) * 3600
+VOICE_CACHE_SIMILARITY = float(os.getenv("VOICE_CACHE_SIMILARITY", "0.82"))
+# 비슷한 질문이라도 서로 다른 n-gram이 이보다 많으면 다른 질문으로 봐요
+VOICE_CACHE_MAX_NGRAM_DIFF = int(os.getenv("VOICE_CACHE_MAX_NGRAM_DIFF", "6"))
+VOICE_CACHE_NGRAM = int(os.getenv("VOICE_CACHE_NGRAM", "2"))
+# Azure OpenAI를 못 쓸 때는 덜 비슷한 질문의 답도 빌려 써요
+VOICE_DEGRADED_SIMILARITY = float(os.getenv("VOICE_DEGRADED_SIMILARITY", "0.7"))
+
+# 질문 속 품목/부분 이름 → 종류 (캔 ↔ 병, 페트병 ↔ 유리병처럼 한 단어만 달라도 답이 달라져요)
+QUESTION_KEYWORDS = {
+    "페트병": "pet", "페트": "pet", "생수병": "pet",
+    "유리병": "glass", "유리": "glass", "소주병": "glass", "맥주병": "glass",
+    "병": "bottle",
+    "캔": "can", "통조림": "can", "알루미늄": "can",
+    "우유팩": "carton", "종이팩": "carton", "멸균팩": "carton",
+    "종이컵": "paper_cup",
+    "종이": "paper", "신문": "paper", "박스": "box", "상자": "box", "택배": "box",
+    "플라스틱": "plastic", "비닐": "vinyl", "봉지": "vinyl", "스티로폼": "styrofoam",
+    "옷": "clothes", "의류": "clothes",
+    "건전지": "battery", "배터리": "battery", "전지": "battery",
+    "형광등": "lamp", "전구": "lamp",
+    "컴퓨터": "computer", "노트북": "computer", "휴대폰": "computer", "핸드폰": "computer",
+    "음식물": "food", "치킨": "chicken", "피자": "pizza",
+    "라벨": "label", "스티커": "label", "뚜껑": "cap", "깨진": "broken", "깨졌": "broken"
+}
+QUESTION_KEYWORD_PATTERN = re.compile("|".join(sorted(map(re.escape, QUESTION_KEYWORDS), key=len, reverse=True)))
+
+def question_keywords(key):
+    return frozenset(QUESTION_KEYWORDS[word] for word in QUESTION_KEYWORD_PATTERN.findall(key))
+
+# 여러 워커 프로세스가 같이 쓰는 SQLite 캐시 (재시작해도 남아 있어요)
+SHARED_CACHE_DB = os.getenv("SHARED_CACHE_DB", ".cache/shared.sqlite3")
+SHARED_CACHE_SYNC_INTERVAL = float(os.getenv("SHARED_CACHE_SYNC_INTERVAL", "5"))
+
+class SharedAnswerStore:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS voice_answers "
+            "(key TEXT PRIMARY KEY, answer TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS voice_answers_created ON voice_answers (created)")
 
-    answer = response.choices[0].message.content.strip()
+    def put(self, key, answer, created):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO voice_answers (key, answer, created) VALUES (?, ?, ?)",
+                (key, answer, created)
+            )
 
-    # ✅ TTS로 음성 파일 생성
-    mp3_path = text_to_speech(answer)
+    def since(self, created):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT key, answer, created FROM voice_answers WHERE created > ? ORDER BY created",
+                (created,)
+            ).fetchall()
+
+    def purge(self, before):
+        with self.lock:
+            self.conn.execute("DELETE FROM voice_answers WHERE created < ?", (before,))
+
+# 띄어쓰기/문장부호/대소문자 차이는 같은 질문으로 봐요
+def normalize_question(text):
+    text = unicodedata.normalize("NFKC", text).lower()
+    return re.sub(r"[\W_]+", "", text)
+
+def char_ngrams(text, n):
+    if len(text) <= n:
+        return Counter([text])
+    return Counter(text[i:i + n] for i in range(len(text) - n + 1))
+
+# 정규화한 질문이 똑같으면 바로, 아니면 글자 n-gram 코사인 유사도로 가장 비슷한 질문을 찾아요
+# 비슷한 질문은 품목/부분 이름이 똑같고(없으면 정확히 같은 질문만), 다른 n-gram이 몇 개 안 될 때만 써요
+class AnswerCache:
+    def __init__(self, max_size, ttl, threshold, ngram, shared=None):
+        self.shared = shared
+        self.synced_at = 0.0
+        self.last_sync = 0.0
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.ngram = ngram
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # 정규화된 질문 → (답변, n-gram, 크기, 저장 시각, 품목/부분 이름)
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    # 다른 워커가 저장한 답변을 주기적으로 가져와요
+    def _sync(self, now):
+        if self.shared is None or now - self.last_sync < SHARED_CACHE_SYNC_INTERVAL:
+            return
+        self.last_sync = now
+        try:
+            self.shared.purge(now - self.ttl)
+            rows = self.shared.since(max(self.synced_at, now - self.ttl))
+        except sqlite3.Error:
+            logger.exception("공유 캐시 동기화 실패")
+            return
+        for key, answer, created in rows:
+            self._insert(key, answer, created)
+            self.synced_at = max(self.synced_at, created)
+
+    def _insert(self, key, answer, created):
+        grams = char_ngrams(key, self.ngram)
+        norm = math.sqrt(sum(v * v for v in grams.values()))
+        self.entries.pop(key, None)
+        self.entries[key] = (answer, grams, norm, created, question_keywords(key))
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get(self, question, threshold=None):
+        threshold = self.threshold if threshold is None else threshold
+        key = normalize_question(question)
+        now = time.time()
+        with self.lock:
+            self._sync(now)
+            for expired in [k for k, entry in self.entries.items() if now - entry[3] > self.ttl]:
+                del self.entries[expired]
+
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.exact_hits += 1
+                return self.entries[key][0]
+
+            grams = char_ngrams(key, self.ngram)
+            norm = math.sqrt(sum(v * v for v in grams.values()))
+            keywords = question_keywords(key)
+            best_key, best_score = None, 0.0
+            for other_key, (_, other_grams, other_norm, _, other_keywords) in self.entries.items():
+                if not keywords or other_keywords != keywords:
+                    continue
+                if sum(((grams - other_grams) + (other_grams - grams)).values()) > VOICE_CACHE_MAX_NGRAM_DIFF:
+                    continue
+                dot = sum(count * other_grams.get(gram, 0) for gram, count in grams.items())
+                score = dot / (norm * other_norm) if norm and other_norm else 0.0
+                if score > best_score:
+                    best_key, best_score = other_key, score
+
+            if best_key is not None and best_score >= threshold:
+                self.entries.move_to_end(best_key)
+                self.similar_hits += 1
+                return self.entries[best_key][0]
+
+            self.misses += 1
+            return None
+
+    def put(self, question, answer):
+        key = normalize_question(question)
+        if not key or not answer:
+            return
+        created = time.time()
+        with self.lock:
+            self._insert(key, answer, created)
+        if self.shared is not None:
+            try:
+                self.shared.put(key, answer, created)
+            except sqlite3.Error:
+                logger.exception("공유 캐시 저장 실패")
+
+    def stats(self):
+        with self.lock:
+            lookups = self.exact_hits + self.similar_hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0,
+                "size": len(self.entries)
+            }
+
+answer_cache = AnswerCache(
+    VOICE_CACHE_SIZE, VOICE_CACHE_TTL, VOICE_CACHE_SIMILARITY, VOICE_CACHE_NGRAM,
+    shared=SharedAnswerStore(SHARED_CACHE_DB) if SHARED_CACHE_DB else None
+)
 
-    # ✅ 텍스트와 함께 반환
-    answer_html = f"""
+# 동시에 처리할 요청 수와 대기열 설정
+VOICE_CONCURRENCY = int(os.getenv("VOICE_CONCURRENCY", "8"))
+IMAGE_CONCURRENCY = int(os.getenv("IMAGE_CONCURRENCY", "8"))
+QUEUE_MAX_SIZE = int(os.getenv("QUEUE_MAX_SIZE", "50"))
+QUEUE_MAX_WAIT = float(os.getenv("QUEUE_MAX_WAIT", "30"))
+QUEUE_POLL_INTERVAL = 1.0
+GRADIO_QUEUE_MAX_SIZE = int(os.getenv("GRADIO_QUEUE_MAX_SIZE", "500"))
+
+BUSY_MESSAGE = "지금 친구들이 많이 물어보고 있어요. 잠시 후 다시 시도해 주세요! 🙏"
+
+class AdmissionRejected(Exception):
+    pass
+
+# 동시에 limit개까지만 처리하고, 나머지는 순서대로 기다리게 해요
+# 대기열이 꽉 찼거나 너무 오래 기다리면 바로 "잠시 후 다시" 답을 줘요
+class AdmissionController:
+    def __init__(self, name, limit, max_queue, max_wait):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # 기다리는 동안 대기 순번을 내보내고, 차례가 되면 끝나요
+    async def enter(self):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            self._record_wait(0.0)
+            return
+        if len(self.waiters) >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(BUSY_MESSAGE)
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        started = time.monotonic()
+        last_position = None
+        try:
+            while not future.done():
+                position = self.waiters.index(future) + 1
+                if position != last_position:
+                    last_position = position
+                    yield position
+                remaining = started + self.max_wait - time.monotonic()
+                if remaining <= 0:
+                    self.timed_out += 1
+                    raise AdmissionRejected(BUSY_MESSAGE)
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), min(remaining, QUEUE_POLL_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if future.done():
+                # 차례를 받았는데 떠나는 거라 자리를 다음 사람에게 넘겨요
+                self.release()
+            else:
+                future.cancel()
+                self.waiters.remove(future)
+            raise
+        self._record_wait(time.monotonic() - started)
+
+    def release(self):
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(True)
+                return
+        self.active -= 1
+
+    def _record_wait(self, waited):
+        self.admitted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "limit": self.limit,
+            "queue_depth": len(self.waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_seconds_avg": self.wait_total / self.admitted if self.admitted else 0.0,
+            "wait_seconds_max": self.wait_max
+        }
+
+voice_admission = AdmissionController("voice", VOICE_CONCURRENCY, QUEUE_MAX_SIZE, QUEUE_MAX_WAIT)
+image_admission = AdmissionController("image", IMAGE_CONCURRENCY, QUEUE_MAX_SIZE, QUEUE_MAX_WAIT)
+
+def queue_message(position):
+    return f"⏳ 지금 {position}번째로 기다리고 있어요. 조금만 기다려 주세요!"
+
+# 핸들러(async generator)를 대기열 뒤에서 실행해요
+# render는 안내 문구를 핸들러 출력 모양으로 바꿔줘요
+def with_admission(controller, render):
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(value):
+            if value is None:
+                async for output in handler(value):
+                    yield output
+                return
+
+            started = time.perf_counter()
+            try:
+                async for position in controller.enter():
+                    yield render(queue_message(position))
+            except AdmissionRejected as e:
+                metrics.inc("little_detective_rejected_total", handler=controller.name)
+                yield render(str(e))
+                return
+            metrics.observe("queue", controller.name, time.perf_counter() - started)
+
+            # Gradio가 단계마다 다른 태스크에서 부를 수 있어서 매번 핸들러 이름을 다시 넣어요
+            outputs = handler(value).__aiter__()
+            try:
+                while True:
+                    current_handler.set(controller.name)
+                    try:
+                        output = await outputs.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    yield output
+            finally:
+                await outputs.aclose()
+                controller.release()
+                metrics.observe("total", controller.name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+# Azure OpenAI 호출 한도 (배포의 분당 요청/토큰 한도를 응답 헤더로 따라가요)
+CHAT_INITIAL_CONCURRENCY = int(os.getenv("CHAT_INITIAL_CONCURRENCY", "4"))
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "32"))
+CHAT_LIMIT_MAX_QUEUE = int(os.getenv("CHAT_LIMIT_MAX_QUEUE", "100"))
+CHAT_LIMIT_MAX_WAIT = float(os.getenv("CHAT_LIMIT_MAX_WAIT", "10"))
+CHAT_MAX_RETRIES = int(os.getenv("CHAT_MAX_RETRIES", "2"))
+CHAT_COMPLETION_TOKENS = int(os.getenv("CHAT_COMPLETION_TOKENS", "400"))  # 답변 하나에 쓰일 토큰 어림값
+CHAT_DEFAULT_RETRY_AFTER = 1.0
+CHAT_BUDGET_WINDOW = 60.0
+
+class ChatOverloaded(AdmissionRejected):
+    pass
+
+# 프롬프트 글자 수 + 답변 어림값 (한글은 대략 한 글자에 토큰 하나예요)
+def estimate_chat_tokens(messages):
+    return sum(len(m.get("content") or "") for m in messages) + CHAT_COMPLETION_TOKENS
+
+def header_number(headers, name):
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+# AIMD: 성공하면 동시 요청 한도를 천천히(+1/한도) 올리고, 429가 오면 반으로 줄여요
+# 남은 요청/토큰 수는 응답 헤더로 맞추고, 그 사이에는 분당 한도만큼 채워진다고 어림해요
+# 예산이 모자라면 순서대로 기다리고, 제때 못 들어갈 것 같으면 Azure에 보내기 전에 돌려보내요
+class ChatRateLimiter:
+    def __init__(self, initial, maximum, max_queue, max_wait):
+        self.limit = float(max(1, min(initial, maximum)))
+        self.maximum = maximum
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiters = deque()
+        self.changed = None
+        self.paused_until = 0.0
+        self.budget = {"requests": None, "tokens": None}  # 남은 양 (None이면 아직 몰라요)
+        self.budget_limit = {"requests": None, "tokens": None}  # 분당 한도 (헤더에 없으면 본 것 중 가장 큰 남은 양)
+        self.budget_updated = time.monotonic()
+        self.admitted = 0
+        self.shed = 0
+        self.throttled = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.budget_updated
+        self.budget_updated = now
+        for kind, remaining in self.budget.items():
+            limit = self.budget_limit[kind]
+            if remaining is not None and limit:
+                self.budget[kind] = min(limit, remaining + limit * elapsed / CHAT_BUDGET_WINDOW)
+
+    # 지금 바로 보낼 수 있으면 0, 아니면 예산이 찰 때까지 남은 시간(초)
+    def _delay(self, tokens):
+        self._refill()
+        delay = max(0.0, self.paused_until - time.monotonic())
+        for kind, needed in (("requests", 1), ("tokens", tokens)):
+            remaining, limit = self.budget[kind], self.budget_limit[kind]
+            if remaining is None or not limit:
+                continue
+            needed = min(needed, limit)
+            if remaining < needed:
+                delay = max(delay, (needed - remaining) * CHAT_BUDGET_WINDOW / limit)
+        return delay
+
+    def _try_start(self, tokens):
+        if self.active >= int(self.limit) or self._delay(tokens) != 0:
+            return False
+        self.active += 1
+        self.admitted += 1
+        for kind, used in (("requests", 1), ("tokens", tokens)):
+            if self.budget[kind] is not None:
+                self.budget[kind] -= used
+        return True
+
+    def _notify(self):
+        if self.changed is not None:
+            self.changed.set()
+            self.changed = None
+
+    def _shed(self):
+        self.shed += 1
+        metrics.inc("little_detective_rejected_total", handler="chat")
+        raise ChatOverloaded(BUSY_MESSAGE)
+
+    async def acquire(self, tokens):
+        if not self.waiters and self._try_start(tokens):
+            return
+        if len(self.waiters) >= self.max_queue:
+            self._shed()
+        ticket = object()
+        self.waiters.append(ticket)
+        deadline = time.monotonic() + self.max_wait
+        try:
+            while True:
+                if self.waiters[0] is ticket and self._try_start(tokens):
+                    return
+                remaining = deadline - time.monotonic()
+                delay = self._delay(tokens)
+                if remaining <= 0 or delay > remaining:
+                    self._shed()
+                if self.changed is None:
+                    self.changed = asyncio.Event()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), min(remaining, delay) if delay else remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.waiters.remove(ticket)
+            self._notify()
+
+    # Azure 응답 헤더에서 남은 요청/토큰 수와 한도를 읽어요
+    def update(self, headers):
+        self._refill()
+        for kind in ("requests", "tokens"):
+            remaining = header_number(headers, f"x-ratelimit-remaining-{kind}")
+            limit = header_number(headers, f"x-ratelimit-limit-{kind}")
+            if remaining is not None:
+                self.budget[kind] = remaining
+                self.budget_limit[kind] = limit or max(self.budget_limit[kind] or 0.0, remaining)
+            elif limit is not None:
+                self.budget_limit[kind] = limit
+        self._notify()
+
+    def release(self, succeeded=False, throttled=False, headers=None):
+        self.active -= 1
+        if throttled:
+            self.throttled += 1
+            self.limit = max(1.0, self.limit / 2)
+            retry_after = header_number(headers or {}, "retry-after") or CHAT_DEFAULT_RETRY_AFTER
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            metrics.inc("little_detective_chat_throttled_total")
+            if headers is not None:
+                self.update(headers)
+        elif succeeded:
+            self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+        self._notify()
+
+    def stats(self):
+        self._refill()
+        return {
+            "active": self.active,
+            "limit": self.limit,
+            "queue_depth": len(self.waiters),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "throttled": self.throttled,
+            "paused_seconds": max(0.0, self.paused_until - time.monotonic()),
+            "remaining_requests": self.budget["requests"],
+            "remaining_tokens": self.budget["tokens"]
+        }
+
+# 헤지 설정 (CHAT_HEDGE_PERCENTILE: 첫 배포를 얼마나 기다렸다가 다른 배포에도 보낼지)
+CHAT_HEDGE = os.getenv("CHAT_HEDGE", "1") == "1"
+CHAT_HEDGE_PERCENTILE = float(os.getenv("CHAT_HEDGE_PERCENTILE", "95"))
+CHAT_HEDGE_DEFAULT_DELAY = float(os.getenv("CHAT_HEDGE_DELAY", "2"))  # 기록이 모자랄 때
+CHAT_HEDGE_MIN_SAMPLES = 20
+CHAT_LATENCY_WINDOW = 200
+CHAT_HEALTH_DECAY = 0.1
+
+# 배포 하나 (클라이언트, 호출 한도, 최근 첫 토큰 시간과 성공률)
+class ChatDeployment:
+    def __init__(self, config):
+        self.config = config
+        self.name = config["name"]
+        self.model = config["deployment"]
+        self.client = None
+        self.limiter = ChatRateLimiter(CHAT_INITIAL_CONCURRENCY, CHAT_MAX_CONCURRENCY, CHAT_LIMIT_MAX_QUEUE, CHAT_LIMIT_MAX_WAIT)
+        # 첫 토큰까지의 시간으로 느림을 판단해요
+        self.breaker = CircuitBreaker(f"chat:{self.name}", CHAT_TIMEOUT * BREAKER_SLOW_RATIO)
+        self.first_tokens = deque(maxlen=CHAT_LATENCY_WINDOW)
+        self.latency_ewma = None
+        self.success_rate = 1.0
+        self.failures = 0
+        self.hedge_wins = 0
+
+    def get_client(self):
+        if self.client is None:
+            self.client = openai.AsyncAzureOpenAI(
+                api_key=self.config["api_key"],
+                api_version=self.config["api_version"],
+                azure_endpoint=self.config["endpoint"],
+                # 429 재시도는 limiter가 한도를 보고 해요 (SDK가 따로 재시도하면 폭주해요)
+                max_retries=0
+            )
+        return self.client
+
+    def observe_first_token(self, seconds):
+        self.first_tokens.append(seconds)
+        if self.latency_ewma is None:
+            self.latency_ewma = seconds
+        else:
+            self.latency_ewma += CHAT_HEALTH_DECAY * (seconds - self.latency_ewma)
+
+    def observe_result(self, ok):
+        if not ok:
+            self.failures += 1
+        self.success_rate += CHAT_HEALTH_DECAY * ((1.0 if ok else 0.0) - self.success_rate)
+
+    def hedge_delay(self):
+        if len(self.first_tokens) < CHAT_HEDGE_MIN_SAMPLES:
+            return CHAT_HEDGE_DEFAULT_DELAY
+        ordered = sorted(self.first_tokens)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(CHAT_HEDGE_PERCENTILE / 100 * len(ordered)) - 1))]
+
+    # 빠르고 잘 되는 배포일수록 자주 골라요 (429로 쉬는 중이면 거의 안 골라요)
+    def weight(self):
+        weight = max(self.success_rate, 0.01) / max(self.latency_ewma or 1.0, 0.05)
+        if self.limiter.paused_until > time.monotonic():
+            weight *= 0.05
+        return weight
+
+    def stats(self):
+        return {
+            **self.limiter.stats(),
+            "breaker": self.breaker.state,
+            "weight": self.weight(),
+            "success_rate": self.success_rate,
+            "failures": self.failures,
+            "first_token_seconds_avg": self.latency_ewma,
+            "hedge_delay_seconds": self.hedge_delay(),
+            "hedge_wins": self.hedge_wins
+        }
+
+chat_deployments = [ChatDeployment(config) for config in CHAT_DEPLOYMENT_CONFIGS]
+
+# 차단기가 열린 배포는 빼고, 첫 배포는 가중치 비율로 뽑고, 나머지는 가중치가 큰 순서로 헤지/대체에 써요
+def route_chat_deployments():
+    available = [deployment for deployment in chat_deployments if deployment.breaker.available()]
+    if not available:
+        raise CircuitOpen("chat")
+    weights = [deployment.weight() for deployment in available]
+    primary = random.choices(available, weights)[0]
+    others = sorted((d for d in available if d is not primary), key=lambda d: d.weight(), reverse=True)
+    return [primary] + others
+
+# 업스트림 차단기가 열렸을 때 쓰는 문구
+STT_UNAVAILABLE_MESSAGE = "음성 인식 서비스가 잠시 쉬고 있어요. 조금 뒤에 다시 말해 주세요! 🙏"
+VISION_UNAVAILABLE_MESSAGE = "이미지 분석 서비스가 잠시 쉬고 있어요. 조금 뒤에 다시 찍어 주세요! 🙏"
+CANNED_VOICE_ANSWER = "지금은 탐정이 잠깐 쉬고 있어요 😅 분리수거는 내용물을 비우고 🧽, 깨끗이 헹구고 💧, 재질별로 나눠서 버리면 돼요! ♻️ 조금 뒤에 다시 물어봐 줘요!"
+
+def voice_answer_html(answer):
+    return f"""
 ### 🔍 탐정의 대답
 <div style="border:1px solid #D8D8DA; border-radius:8px; padding:12px; background-color:#ffffff;">
 {answer}
 </div>
 """
 
-    return answer_html, mp3_path
+# 음성 인식 함수 (답변이 도착하는 대로 조금씩 보여줘요)
+@with_admission(voice_admission, lambda message: (message, None))
+async def handle_voice_input(audio_path):
+    if audio_path is None:
+        yield "", None
+        return
 
-def classify_and_explain(image):
-    image.save("temp.jpg")
-    with open("temp.jpg", "rb") as f:
-        img_data = f.read()
+    try:
+        loop = asyncio.get_running_loop()
+        with timed("stt"):
+            user_text = await stt_breaker.call(
+                lambda: asyncio.wait_for(loop.run_in_executor(stt_pool, recognize_speech, audio_path), STT_TIMEOUT),
+                ignore=(sr.UnknownValueError,)
+            )
+    except CircuitOpen:
+        yield STT_UNAVAILABLE_MESSAGE, None
+        return
+    except sr.UnknownValueError:
+        metrics.inc("little_detective_stt_failures_total", reason="unknown_value")
+        yield "음성을 인식하지 못했어요. 다시 말씀해 주세요.", None
+        return
+    except sr.RequestError:
+        metrics.inc("little_detective_stt_failures_total", reason="request_error")
+        yield "음성 인식 서비스에 문제가 발생했어요.", None
+        return
+    except asyncio.TimeoutError:
+        yield TIMEOUT_MESSAGE, None
+        return
+
+    # 자주 묻는 질문은 캐시에서 바로 답해요 (mp3도 TTS 저장소에 있어요)
+    cached_answer = answer_cache.get(user_text)
+    if cached_answer is not None:
+        yield voice_answer_html(cached_answer), await text_to_speech_or_none(cached_answer)
+        return
+
+    answer = ""
+    try:
+        async for answer in stream_chat([
+            {"role": "system", "content": VOICE_SYSTEM_PROMPT},
+            {"role": "user", "content": user_text}
+        ]):
+            if STREAM_ANSWERS:
+                yield voice_answer_html(answer), None
+        answer = answer.strip()
+        answer_cache.put(user_text, answer)
+    except (asyncio.TimeoutError, openai.APITimeoutError):
+        yield TIMEOUT_MESSAGE, None
+        return
+    except ChatOverloaded as e:
+        yield str(e), None
+        return
+    except openai.OpenAIError:
+        logger.exception("음성 질문 답변 실패")
+        yield CHAT_ERROR_MESSAGE, None
+        return
+    except CircuitOpen:
+        answer = answer_cache.get(user_text, threshold=VOICE_DEGRADED_SIMILARITY)
+        metrics.inc("little_detective_degraded_total", upstream="chat", fallback="canned" if answer is None else "similar_answer")
+        answer = answer or CANNED_VOICE_ANSWER
+
+    # ✅ TTS로 음성 파일 생성 (답변이 다 끝난 뒤에)
+    mp3_path = await text_to_speech_or_none(answer)
 
-    headers = {
-        "Prediction-Key": CUSTOM_VISION_KEY,
-        "Content-Type": "application/octet-stream"
-    }
-    url = f"{CUSTOM_VISION_ENDPOINT}/customvision/v3.0/Prediction/{CUSTOM_VISION_PROJECT_ID}/classify/iterations/{CUSTOM_VISION_ITERATION_NAME}/image"
-    response = requests.post(url, headers=headers, data=img_data)
+    # ✅ 텍스트와 함께 반환
+    yield voice_answer_html(answer), mp3_path
+
+# 스레드마다 버퍼 하나를 재사용해요
+_image_buffer = threading.local()
+
+# 이미지를 파일 없이 메모리에서 JPEG로 변환 (큰 사진은 줄여서)
+def encode_image(image):
+    if max(image.size) > IMAGE_MAX_DIMENSION:
+        image = image.copy()
+        image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    buffer = getattr(_image_buffer, "buffer", None)
+    if buffer is None:
+        buffer = _image_buffer.buffer = io.BytesIO()
+    buffer.seek(0)
+    buffer.truncate()
+    image.save(buffer, format="JPEG", quality=IMAGE_JPEG_QUALITY)
+    return buffer.getvalue()
+
+# Retry-After가 있으면 따르고, 없으면 지수 백오프 + 지터
+def retry_delay(response, attempt):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    try:
+        return min(float(retry_after), 10.0)
+    except (TypeError, ValueError):
+        return CUSTOM_VISION_BACKOFF * (2 ** attempt) * (0.5 + random.random())
+
+vision_breaker = CircuitBreaker("vision", VISION_TIMEOUT * BREAKER_SLOW_RATIO)
+
+async def predict_image(img_data):
+    async def call():
+        with timed("vision"):
+            return await _predict_image(img_data)
+    return await vision_breaker.call(call)
+
+async def _predict_image(img_data):
+    for attempt in range(CUSTOM_VISION_MAX_RETRIES + 1):
+        last_attempt = attempt == CUSTOM_VISION_MAX_RETRIES
+        try:
+            response = await prediction_client.post(CUSTOM_VISION_URL, content=img_data)
+        except (httpx.ConnectError, httpx.RemoteProtocolError):
+            if last_attempt:
+                raise
+            await asyncio.sleep(retry_delay(None, attempt))
+            continue
+        if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+            break
+        metrics.inc("little_detective_upstream_retries_total", upstream="custom_vision", status=str(response.status_code))
+        await asyncio.sleep(retry_delay(response, attempt))
+
+    return response.json()["predictions"]
+
+def howto_html(explanation, done=True):
+    closing = "<br><br>👍 환경을 생각하는 멋진 선택이에요 🌱" if done else ""
+    return f"""### ♻️이렇게 버려요!  
+<div style="border:1px solid #D8D8DA; border-radius:8px; padding:12px; background-color:#ffffff;">{explanation}{closing}</div>"""
+
+# 기기 안에서 도는 분류 모델 설정 (Custom Vision에서 내보낸 ONNX 등)
+LOCAL_CLASSIFIER_PATH = os.getenv("LOCAL_CLASSIFIER_PATH")
+LOCAL_CLASSIFIER_LABELS = os.getenv("LOCAL_CLASSIFIER_LABELS")
+LOCAL_CLASSIFIER_BGR = os.getenv("LOCAL_CLASSIFIER_BGR", "1") == "1"
+LOCAL_BATCH_SIZE = int(os.getenv("LOCAL_BATCH_SIZE", "16"))
+LOCAL_BATCH_WAIT = float(os.getenv("LOCAL_BATCH_WAIT_MS", "5")) / 1000
+LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv("LOCAL_CONFIDENCE_THRESHOLD", "0.7"))
+# cloud: Custom Vision만 / local: 로컬 모델만 / local_first: 로컬 먼저, 자신 없으면 Custom Vision
+CLASSIFIER_POLICY = os.getenv("CLASSIFIER_POLICY", "local_first" if LOCAL_CLASSIFIER_PATH else "cloud")
+
+class LocalClassifierError(Exception):
+    pass
+
+# 결과는 Custom Vision과 같은 모양 ([{"tagName", "probability"}, ...], 확률 높은 순)으로 돌려줘요
+class LocalClassifier:
+    def __init__(self, model_path, labels_path=None):
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        shape = model_input.shape
+        self.fixed_batch = shape[0] == 1
+        self.height = shape[2] if isinstance(shape[2], int) else 224
+        self.width = shape[3] if isinstance(shape[3], int) else 224
+        labels_path = labels_path or os.path.join(os.path.dirname(model_path), "labels.txt")
+        with open(labels_path, encoding="utf-8") as f:
+            self.labels = [line.strip() for line in f if line.strip()]
+
+    def preprocess(self, image):
+        image = image.convert("RGB").resize((self.width, self.height))
+        array = np.asarray(image, dtype=np.float32)
+        if LOCAL_CLASSIFIER_BGR:
+            array = array[:, :, ::-1]
+        return np.ascontiguousarray(array.transpose(2, 0, 1))
+
+    def run(self, arrays):
+        batch = np.stack(arrays)
+        if self.fixed_batch:
+            scores = np.concatenate([self.session.run(None, {self.input_name: item[None]})[0] for item in batch])
+        else:
+            scores = self.session.run(None, {self.input_name: batch})[0]
+        scores = scores.reshape(len(arrays), -1)
+        # 확률이 아니라 로짓이면 softmax
+        if not np.allclose(scores.sum(axis=1), 1.0, atol=1e-3) or scores.min() < 0:
+            scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+            scores /= scores.sum(axis=1, keepdims=True)
+        results = []
+        for row in scores:
+            order = np.argsort(row)[::-1]
+            results.append([{"tagName": self.labels[i], "probability": float(row[i])} for i in order])
+        return results
+
+    def warm_up(self):
+        self.run([np.zeros((3, self.height, self.width), dtype=np.float32)])
+
+# 짧은 시간(LOCAL_BATCH_WAIT) 동안 모인 요청을 한 번에 추론해요
+class LocalBatcher:
+    def __init__(self, max_batch, max_wait):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = None
+        self.task = None
+
+    async def predict(self, classifier, image):
+        if self.task is None:
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self._run(classifier))
+        array = await asyncio.to_thread(classifier.preprocess, image)
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((array, future))
+        return await future
+
+    async def _run(self, classifier):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                results = await asyncio.to_thread(classifier.run, [array for array, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(LocalClassifierError(str(e)))
+                continue
+            for (_, future), predictions in zip(batch, results):
+                if not future.done():
+                    future.set_result(predictions)
+
+_local_classifier = None
+_local_classifier_lock = threading.Lock()
+local_batcher = LocalBatcher(LOCAL_BATCH_SIZE, LOCAL_BATCH_WAIT)
+
+# 모델은 프로세스에서 한 번만 읽어요 (설정이 없으면 None)
+def get_local_classifier():
+    global _local_classifier
+    if not LOCAL_CLASSIFIER_PATH:
+        return None
+    with _local_classifier_lock:
+        if _local_classifier is None:
+            _local_classifier = LocalClassifier(LOCAL_CLASSIFIER_PATH, LOCAL_CLASSIFIER_LABELS)
+        return _local_classifier
+
+def warm_up_local_classifier():
+    try:
+        classifier = get_local_classifier()
+        if classifier is not None:
+            classifier.warm_up()
+    except Exception:
+        logger.exception("로컬 분류 모델 준비 실패")
+
+# 비슷한 사진 다시 쓰기 설정
+IMAGE_DEDUPE_SIZE = int(os.getenv("IMAGE_DEDUPE_SIZE", "512"))
+IMAGE_DEDUPE_DISTANCE = int(os.getenv("IMAGE_DEDUPE_DISTANCE", "6"))
+
+# 64비트 dHash: 9x8 흑백으로 줄이고 옆 픽셀보다 밝은지를 비트로 만들어요
+def image_dhash(image):
+    small = np.asarray(image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+# 최근 사진의 해시와 분류 결과를 기억해 두고, 거의 같은 사진이면 결과를 다시 써요
+class ImageHashIndex:
+    def __init__(self, max_size, max_distance):
+        self.max_size = max_size
+        self.max_distance = max_distance
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # 해시 → 분류 결과
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_hash):
+        with self.lock:
+            best_hash, best_distance = None, self.max_distance + 1
+            for other_hash in self.entries:
+                distance = bin(image_hash ^ other_hash).count("1")
+                if distance < best_distance:
+                    best_hash, best_distance = other_hash, distance
+            if best_hash is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_hash)
+            self.hits += 1
+            return self.entries[best_hash]
+
+    def put(self, image_hash, predictions):
+        with self.lock:
+            self.entries.pop(image_hash, None)
+            self.entries[image_hash] = predictions
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "saved_predictions": self.hits,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": len(self.entries)
+            }
+
+image_hash_index = ImageHashIndex(IMAGE_DEDUPE_SIZE, IMAGE_DEDUPE_DISTANCE)
+
+# 거의 같은 사진을 최근에 분류했으면 그 결과를 바로 돌려줘요
+async def classify_image(image):
+    with timed("image_hash"):
+        image_hash = await asyncio.to_thread(image_dhash, image)
+    predictions = image_hash_index.get(image_hash)
+    if predictions is None:
+        predictions = await classify_image_uncached(image)
+        if predictions:
+            image_hash_index.put(image_hash, predictions)
+    return predictions
+
+async def predict_local(image):
+    classifier = await asyncio.to_thread(get_local_classifier)
+    if classifier is None:
+        raise LocalClassifierError("LOCAL_CLASSIFIER_PATH가 설정되지 않았어요.")
+    with timed("local_classifier"):
+        return await local_batcher.predict(classifier, image)
+
+# CLASSIFIER_POLICY에 따라 로컬 모델 / Custom Vision으로 분류해요
+# Custom Vision 차단기가 열려 있으면 로컬 모델 답을 (자신 없어도) 써요
+async def classify_image_uncached(image):
+    local_predictions = None
+    if CLASSIFIER_POLICY in ("local", "local_first"):
+        try:
+            local_predictions = await predict_local(image)
+            if CLASSIFIER_POLICY == "local" or (local_predictions and local_predictions[0]["probability"] >= LOCAL_CONFIDENCE_THRESHOLD):
+                return local_predictions
+        except Exception as e:
+            if CLASSIFIER_POLICY == "local":
+                raise LocalClassifierError(str(e)) from e
+            logger.exception("로컬 분류 실패, Custom Vision으로 넘어가요")
+
+    if not vision_breaker.available():
+        if local_predictions is None and LOCAL_CLASSIFIER_PATH:
+            try:
+                local_predictions = await predict_local(image)
+            except Exception:
+                logger.exception("로컬 분류 실패")
+        if local_predictions:
+            metrics.inc("little_detective_degraded_total", upstream="vision", fallback="local_classifier")
+            return local_predictions
+
+    with timed("image_encode"):
+        img_data = await asyncio.to_thread(encode_image, image)
+    return await predict_image(img_data)
+
+@with_admission(image_admission, lambda message: (message, "", None))
+async def classify_and_explain(image):
+    if image is None:
+        yield "", "", None
+        return
 
     try:
-        predictions = response.json()["predictions"]
+        predictions = await classify_image(image)
         if not predictions:
-            return "이미지를 인식할 수 없어요. 다시 시도해 주세요.", "", None
-    except (KeyError, ValueError):
-        return "이미지 분석 중 오류가 발생했어요.", "", None
+            yield "이미지를 인식할 수 없어요. 다시 시도해 주세요.", "", None
+            return
+    except httpx.TimeoutException:
+        yield TIMEOUT_MESSAGE, "", None
+        return
+    except CircuitOpen:
+        yield VISION_UNAVAILABLE_MESSAGE, "", None
+        return
+    except (KeyError, ValueError, httpx.HTTPError, LocalClassifierError):
+        yield "이미지 분석 중 오류가 발생했어요.", "", None
+        return
 
     top_result = predictions[0]["tagName"]
-
-    tag_kor_map = {
-        'vinyl': '비닐류',
-        'styrofoam': '스티로폼',
-        'glass': '유리병',
-        'clothes': '의류',
-        'paper': '종이류',
-        'can': '캔류',
-        'computer': '컴퓨터',
-        'battery': '폐건전지',
-        'fluorescentlamp': '폐형광등',
-        'plastic': '플라스틱류'
-    }
     top_result_kor = tag_kor_map.get(top_result, top_result)
 
-    prompt = f"'{top_result_kor}'는 어떤 재활용 품목인가요? 어떻게 분리배출해야 하나요? 어린이를 위한 거니까 이모티콘 많이 섞어서, 친절하게 설명해줘."
-    completion = client.chat.completions.create(
-        model="a24-gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "친절한 분리수거 안내 도우미입니다."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-    explanation = completion.choices[0].message.content.strip()
-
-    # ✅ TTS mp3 경로 생성
-    mp3_path = text_to_speech(explanation)
-
     # ✅ 텍스트 출력 + mp3 경로 전달
     answer_text = f"""### 🔍 탐정의 대답  
 <div style="border:1px solid #D8D8DA; border-radius:8px; padding:12px; background-color:#ffffff;">{top_result_kor}</div>"""
 
-    explanation_text = f"""### ♻️이렇게 버려요!  
-<div style="border:1px solid #D8D8DA; border-radius:8px; padding:12px; background-color:#ffffff;">{explanation}<br><br>👍 환경을 생각하는 멋진 선택이에요 🌱</div>"""
-
-    return answer_text, explanation_text, mp3_path
+    # ✅ 캐시된 설명 + mp3 경로 (없으면 스트리밍으로 생성)
+    # (음성을 못 만들면 마지막에도 mp3 경로가 None이라서 끝난 뒤에 한 번 더 내보내요)
+    try:
+        explanation, mp3_path = "", None
+        async for explanation, mp3_path in stream_explanation(top_result):
+            if mp3_path is None and STREAM_ANSWERS:
+                yield answer_text, howto_html(explanation, done=False), None
+        yield answer_text, howto_html(explanation), mp3_path
+    except (asyncio.TimeoutError, openai.APITimeoutError):
+        yield answer_text, TIMEOUT_MESSAGE, None
+    except ChatOverloaded as e:
+        yield answer_text, str(e), None
+    except openai.OpenAIError:
+        logger.exception("품목 설명 실패: %s", top_result)
+        yield answer_text, CHAT_ERROR_MESSAGE, None
 
 
 #마크다운
 def process_text(text):
     return f"### 결과입니다\n- 입력: **{text}**\n- 처리 완료!"
 
-app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
-#css 스타일을 적용하기 위한 Gradio Blocks
-with gr.Blocks(css="""
-footer, .svelte-1ipelgc, .wrap.svelte-1ipelgc {
-    display: none !important;
-}
-
-/* 헤더 - 로고 스타일 */
-.logo-title {
-    display: flex;
-    align-items: center;
-    gap: 12px;
-    font-size: 24px;
-    font-weight: bold;
-    margin-bottom: 0;
-}
-.header-bar {
-    background-color: #d0f0c0;
-    padding: 4px 4px;
-    border-radius: 0 0 16px 16px;
-    box-shadow: 0 4px 10px rgba(0, 0, 0, 0.1);
-}
-.logo-block {
-    display: flex;
-    align-items: center;
-    gap: 18px;
-}
-.header-bar {
-    background-color: #d0f0c0;
-    padding: 16px 24px;
-    border-radius: 0 0 16px 16px;
-    box-shadow: 0 4px 10px rgba(0, 0, 0, 0.1);
-    display: flex;
-    align-items: center;
-    justify-content: space-between;
-}
-.header-left {
-    display: flex;
-    align-items: center;
-    gap: 16px;
-}
-.header-logo {
-    width: 50px;
-    height: auto;
-    border-radius: 12px;
-}
-.brand-text {
-    display: flex;
-    flex-direction: column;
-}
-.brand-title {
-    font-size: 20px;
-    font-weight: bold;
-    color: #2e7d32;
-}
-.brand-sub {
-    font-size: 15px;
-    color: #4d774e;
-    margin-top: 2px;
-}
-.contact-info {
-    font-size: 12px;
-    color: #333;
-    text-align: right;
-    line-height: 1.5;
-}
-.sub-description {
-    font-size: 16px;
-    color: #4d774e;
-    font-weight: 500;
-    text-align: center;
-}
-.fade-in {
-    opacity: 0;
-    transform: scale(0.95);
-    animation: fadeIn 0.6s ease-out forwards;
-}
-@keyframes fadeIn {
-    to {
-        opacity: 1;
-        transform: scale(1);
-    }
-}
-               
-/* 캐릭터 선택 부분 */
-.character-choice-section {
-    display: flex;
-    justify-content: center;
-    align-items: flex-end;
-    gap: 28px;
-    background-color: #f3f3f3;
-    padding: 24px;
-    border-radius: 16px;
-    margin-bottom: 24px;
-    flex-wrap: wrap;
-}
-.choice-bubble {
-    display: flex;
-    align-items: center;
-    gap: 12px;
-}                    
-.character-line {
-    display: flex;
-    justify-content: center;
-    gap: 40px;
-    background-color: #f3f3f3;
-    padding: 30px;
-    border-radius: 16px;
-    margin-bottom: 24px;
-    flex-wrap: wrap;
-}
-.character-img {
-    width: 100px;
-    height: auto;
-    transition: transform 0.3s;
-}
-.character-img:hover {
-    transform: scale(1.1);
-}
-.character-wrapper {
-    position: relative;
-    display: flex;
-    flex-direction: column;
-    align-items: center;
-}
-.character-hover-msg {
-    position: absolute;
-    top: -40px;
-    background: #ffffff;
-    color: #333;
-    border-radius: 12px;
-    padding: 8px 12px;
-    font-size: 14px;
-    font-weight: bold;
-    box-shadow: 0 2px 6px rgba(0,0,0,0.15);
-    opacity: 0;
-    transform: scale(0.8);
-    transition: all 0.3s ease;
-    white-space: nowrap;
-    z-index: 5;
-}
-.character-wrapper {
-    position: relative;
-    display: flex;
-    flex-direction: column;
-    align-items: center;
-    gap: 6px;
-}
-.character-wrapper:hover .character-hover-msg {
-    opacity: 1;
-    transform: scale(1);
-}
-/* 말풍선 */
-.round-msg {
-    position: relative;
-    width: 130px;
-    height: 130px;
-    border-radius: 50%;
-    display: flex;
-    align-items: center;
-    justify-content: center;
-    font-size: 14px;
-    font-weight: bold;
-    color: white;
-    padding: 10px;
-    white-space: pre-line;
-    border: none;
-    cursor: pointer;
-}
-.left-msg::after {
-    content: "";
-    position: absolute;
-    bottom: -16px;
-    left: 25%; /* 왼쪽으로 치우치게 */
-    transform: translateX(-50%);
-    border-left: 10px solid transparent;
-    border-right: 10px solid transparent;
-    border-top: 14px solid #00aaff;
-}
-.right-msg::after {
-    content: "";
-    position: absolute;
-    bottom: -16px;
-    left: 75%; /* 오른쪽으로 치우치게 */
-    transform: translateX(-50%);
-    border-left: 10px solid transparent;
-    border-right: 10px solid transparent;
-    border-top: 14px solid #ff3344;
-}
-.choice-wrapper {
-    display: flex;
-    flex-direction: column;
-    align-items: center;
-    gap: 10px;
-}
-.left-msg {
-    background-color: #00aaff;
-    color: white;
-}
-.speech-bubble {
-    position: relative;
-    width: 300px;         
-    min-height: 90px;    
-    padding: 12px 16px;   
-    border-radius: 30px;
-    display: flex;
-    align-items: center; 
-    justify-content: center;
-    font-size: 16px;
-    font-weight: bold;
-    color: white;
-    white-space: normal;  
-    text-align: center;
-    border: none;
-    cursor: pointer;
-    line-height: 1.4;    
-}
-
-.bubble-text{
-    color: white;
-}
-.bubble-text:hover {
-    transform: scale(1.1);
-    transition: transform 0.2s ease;
-}
-      
-.left-bubble {
-    background-color: #00aaff !important;
-    color: white;
-}
-.left-bubble::after {
-    content: "";
-    position: absolute;
-    /* left 꼬리 위치 보정 */
-    left: -12px;
-    border-right: 14px solid #00aaff;    top: 50%;
-    transform: translateY(-50%);
-    border-top: 10px solid transparent;
-    border-bottom: 10px solid transparent;
-    border-right: 14px solid #00aaff;
-}
-.right-bubble {
-    background-color: #ff3344;
-}
-.right-bubble::after {
-    content: "";
-    position: absolute;
-    top: 50%;
-    right: -12px;
-    transform: translateY(-50%);
-    border-top: 10px solid transparent;
-    border-bottom: 10px solid transparent;
-    border-left: 14px solid #ff3344;
-}
-               
-.right-msg {
-    background-color: #ff3344;
-    color: white;
-}
-.character-section {
-    display: flex;
-    justify-content: center;
-    align-items: center;
-    gap: 40px;
-    padding: 20px;
-    background-color: #f3f3f3;
-    border-radius: 16px;
-    margin-bottom: 20px;
-    flex-wrap: wrap;
-    text-align: center;
-    flex-direction: row;
-}
-#ai-message, #ai-tip {
-    text-align: center;
-    font-size: 24px;
-    font-weight: bold;
-    margin-bottom: 16px;
-    margin-top: 10px;
-}
-.bouncy-icon {
-    width: 120px;
-    height: auto;
-    border-radius: 50%;
-    animation: bounce 1s infinite;
-}
-
-@keyframes bounce {
-    0%, 100% {
-        transform: translateY(0px);
-    }
-    50% {
-        transform: translateY(-6px);
-    }
-
-}
-               
-.tool-section {
-    background-color: #ffffff;
-    border: 2px solid #d0f0c0;
-    border-radius: 16px;
-    padding: 24px;
-    margin-bottom: 24px;
-    box-shadow: 0 4px 6px rgba(0, 0, 0, 0.05);
-    display: flex;
-    flex-direction: column;
-    align-items: center;
-    min-height: 630px;
-}
-.tool-section1 {
-    background-color: #ffffff;
-    padding: 24px;
-    margin-bottom: 24px;
-    box-shadow: 0 4px 6px rgba(0, 0, 0, 0.05);
-    display: flex;
-    flex-direction: column;
-    align-items: center;
-    min-height: 100px;
-}
-
-.tool-section h2 {
-    font-size: 20px;
-    font-weight: bold;
-    color: #2e7d32;
-    margin-bottom: 16px;
-}
-
-.tool-section .gr-microphone,
-.tool-section .gr-image {
-    width: 100%;
-    max-width: 400px;
-}
-
-.tool-section .gr-textbox {
-    margin-top: 16px;
-    width: 100%;
-    max-width: 400px;
-}
-               
- #answer-box {
-        border: 1px solid #D8D8DA;
-        border-radius: 8px;
-        padding: 12px;
-        font-size: 16px;
-        white-space: pre-wrap;
-        min-height: 100px;
-}
-@keyframes shake {
-  0% { transform: translateX(0); }
-  25% { transform: translateX(-5px); }
-  50% { transform: translateX(5px); }
-  75% { transform: translateX(-5px); }
-  100% { transform: translateX(0); }
-}
-
-.correct-animate {
-  animation: fadeIn 0.8s ease-out;
-  color: green;
-  font-weight: bold;
-}
+# 정적 파일: 내용 해시를 붙인 이름(logo.3f2a9c1b7d.png)은 1년 동안 캐시하고,
+# 미리 압축해 둔 .br / .gz 파일이 있으면 그걸 보내요 (tools/build_assets.py)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+class AssetStaticFiles(StaticFiles):
+    def __init__(self, *, directory, prefix="/static"):
+        super().__init__(directory=directory)
+        self.prefix = prefix
+        self.fingerprints = {}  # 원래 이름 → 해시 붙은 이름
+        self.originals = {}  # 해시 붙은 이름 → 원래 이름
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if name.endswith((".br", ".gz")):
+                    continue
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, directory).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()[:10]
+                stem, ext = os.path.splitext(relative)
+                hashed = f"{stem}.{digest}{ext}"
+                self.fingerprints[relative] = hashed
+                self.originals[hashed] = relative
+
+    def url(self, name):
+        return f"{self.prefix}/{self.fingerprints.get(name, name)}"
+
+    async def get_response(self, path, scope):
+        original = self.originals.get(path.replace(os.sep, "/"))
+        if original is not None:
+            path = original.replace("/", os.sep)
+
+        response = None
+        accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+        encodings = [(encoding, suffix) for encoding, suffix in PRECOMPRESSED if encoding in accept_encoding]
+        if encodings:
+            # lookup_path는 static 폴더 밖(../)을 가리키면 찾지 않아요
+            _, source_stat = await asyncio.to_thread(self.lookup_path, path)
+            for encoding, suffix in encodings if source_stat is not None else ():
+                full_path, stat_result = await asyncio.to_thread(self.lookup_path, path + suffix)
+                # 원본을 고친 뒤 다시 압축하지 않았으면 원본을 보내요
+                if stat_result is None or not stat.S_ISREG(stat_result.st_mode) or stat_result.st_mtime < source_stat.st_mtime:
+                    continue
+                # file_response가 If-None-Match / If-Modified-Since를 보고 304를 줘요
+                response = self.file_response(full_path, stat_result, scope)
+                if response.status_code == 200:
+                    response.headers["Content-Type"] = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                response.headers["Content-Encoding"] = encoding
+                break
+        if response is None:
+            response = await super().get_response(path, scope)
+
+        response.headers["Vary"] = "Accept-Encoding"
+        # 해시 없는 이름은 매번 ETag로 바뀌었는지 확인해요 (quiz.json 처럼 선생님이 고치는 파일)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if original is not None else "no-cache"
+        return response
 
-.wrong-animate {
-  animation: shake 0.5s ease-in-out;
-  color: red;
-  font-weight: bold;
-}
-.correct-animate {
-    animation: pop 0.8s ease-out;
-    font-size: 18px;
-    font-weight: bold;
-    color: green;
-    text-align: center;
-    margin-top: 12px;
-}
-.wrong-animate {
-    animation: shake 0.8s ease-in-out;
-    font-size: 18px;
-    font-weight: bold;
-    color: red;
-    text-align: center;
-    margin-top: 12px;
-}
+app = FastAPI()
+static_files = AssetStaticFiles(directory="static")
+app.mount("/static", static_files, name="static")
+
+@app.get("/api/tts/stats")
+def tts_stats():
+    return tts_store.stats()
+
+# TTS mp3는 이름이 내용(문장 / 설명 글) 해시라서 한 번 만들면 안 바뀌어요
+# 64자리는 TTS 저장소, 24자리는 품목 설명 캐시에 있어요
+TTS_AUDIO_DIGEST = re.compile(r"^(?:[0-9a-f]{24}|[0-9a-f]{64})$")
+
+def tts_audio_file(digest):
+    if not TTS_AUDIO_DIGEST.match(digest):
+        return None
+    if len(digest) == 64:
+        return tts_store.path(digest + ".mp3")
+    return os.path.join(EXPLANATION_CACHE_DIR, digest + ".mp3")
+
+def tts_url(path):
+    if not path:
+        return None
+    digest = os.path.basename(path)[:-len(".mp3")]
+    return f"/api/tts/{digest}.mp3" if TTS_AUDIO_DIGEST.match(digest) else None
+
+# "bytes=시작-끝" / "bytes=시작-" / "bytes=-마지막N" 하나만 받아요 (여러 구간이면 None → 전체를 보내요)
+def parse_byte_range(header, size):
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    start, end = match.groups()
+    if start == "":
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        start, end = max(0, size - length), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end:
+        raise ValueError(header)
+    return start, end
+
+# 브라우저가 필요한 구간만 받아서 바로 넘겨 듣고(Range), 다시 받을 때는 304/캐시를 써요
+@app.api_route("/api/tts/{digest}.mp3", methods=["GET", "HEAD"])
+def tts_audio(digest: str, request: Request):
+    path = tts_audio_file(digest)
+    try:
+        size = os.path.getsize(path) if path else None
+    except OSError:
+        size = None
+    if size is None:
+        raise HTTPException(status_code=404)
+
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if etag in request.headers.get("if-none-match", "") or request.headers.get("if-none-match") == "*":
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    # If-Range가 다르면 (옛날 파일 조각을 갖고 있으면) 전체를 보내요
+    if range_header and request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = parse_byte_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        return FileResponse(path, media_type="audio/mpeg", headers=headers)
+
+    start, end = byte_range
+    try:
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+    except OSError:
+        raise HTTPException(status_code=404)
+    return Response(
+        data, status_code=206, media_type="audio/mpeg",
+        headers={**headers, "Content-Range": f"bytes {start}-{start + len(data) - 1}/{size}"}
+    )
 
-@keyframes pop {
-    0% { transform: scale(0.5); opacity: 0; }
-    60% { transform: scale(1.1); opacity: 1; }
-    100% { transform: scale(1); }
-}
+# 재생 버튼: 파일을 Gradio로 복사하지 않고 위 주소를 가리키는 <audio>를 보여줘요
+def audio_player_html(path):
+    url = tts_url(path)
+    return f'<audio src="{url}" controls autoplay preload="auto"></audio>' if url else ""
+
+@app.get("/api/cache/image/stats")
+def image_cache_stats():
+    return image_hash_index.stats()
+
+@app.get("/api/cache/voice/stats")
+def voice_cache_stats():
+    return answer_cache.stats()
+
+# 여러 장 분류 설정
+BATCH_FANOUT = int(os.getenv("BATCH_FANOUT", "8"))
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "200"))
+# 압축을 푼 크기 기준 (zip 폭탄으로 메모리가 터지지 않게)
+BATCH_MAX_IMAGE_BYTES = int(os.getenv("BATCH_MAX_IMAGE_MB", "20")) * 1024 * 1024
+BATCH_MAX_TOTAL_BYTES = int(os.getenv("BATCH_MAX_TOTAL_MB", "300")) * 1024 * 1024
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp")
+
+# 올린 파일(이미지 또는 zip)을 (파일 이름, 바이트) 목록으로 풀어요
+async def read_batch_uploads(files):
+    images = []
+    total = 0
+
+    # 압축을 풀기 전에 장 수와 크기를 먼저 확인해요
+    def reserve(name, size):
+        nonlocal total
+        if len(images) >= BATCH_MAX_IMAGES:
+            raise HTTPException(status_code=413, detail=f"한 번에 {BATCH_MAX_IMAGES}장까지 올릴 수 있어요.")
+        if size > BATCH_MAX_IMAGE_BYTES:
+            raise HTTPException(status_code=413, detail=f"이미지가 너무 커요: {name}")
+        total += size
+        if total > BATCH_MAX_TOTAL_BYTES:
+            raise HTTPException(status_code=413, detail="한 번에 올린 이미지가 너무 커요.")
+
+    uploaded = 0
+    for upload in files:
+        is_zip = (upload.filename or "").lower().endswith(".zip")
+        # 메모리로 읽기 전에 올라온 파일 크기부터 확인해요
+        if upload.size is not None:
+            uploaded += upload.size
+            if upload.size > (BATCH_MAX_TOTAL_BYTES if is_zip else BATCH_MAX_IMAGE_BYTES) or uploaded > BATCH_MAX_TOTAL_BYTES:
+                raise HTTPException(status_code=413, detail=f"파일이 너무 커요: {upload.filename}")
+        data = await upload.read()
+        if is_zip:
+            try:
+                with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                    for info in archive.infolist():
+                        name = info.filename
+                        if info.is_dir() or name.startswith("__MACOSX/") or not name.lower().endswith(IMAGE_EXTENSIONS):
+                            continue
+                        # file_size보다 많이 풀리면 zipfile이 잘라서 CRC 오류(BadZipFile)를 내요
+                        reserve(name, info.file_size)
+                        images.append((name, archive.read(info)))
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"zip 파일을 열 수 없어요: {upload.filename}")
+        else:
+            reserve(upload.filename, len(data))
+            images.append((upload.filename, data))
+    return images
 
-#quiz-yes {
-    background-color: #d0f0c0 !important;  /* 연한 초록 */
-    color: #2e7d32 !important;             /* 진한 초록 텍스트 */
-    font-weight: bold;
-    border-radius: 12px;
-    padding: 10px 20px;
-}
+async def classify_batch_image(name, data, semaphore, explanations):
+    result = {"file": name}
+    try:
+        async with semaphore:
+            image = await asyncio.to_thread(lambda: Image.open(io.BytesIO(data)).convert("RGB"))
+            predictions = await classify_image(image)
+        if not predictions:
+            result["error"] = "이미지를 인식할 수 없어요."
+            return result
+        tag = predictions[0]["tagName"]
+        result.update(tag=tag, tag_kor=tag_kor_map.get(tag, tag), probability=predictions[0].get("probability"))
+        # 같은 태그 설명은 한 번만 가져와서 같이 써요
+        if tag not in explanations:
+            explanations[tag] = asyncio.ensure_future(get_explanation(tag))
+        result["explanation"], _ = await explanations[tag]
+    except Image.DecompressionBombError:
+        result["error"] = "이미지가 너무 커요."
+    except (UnidentifiedImageError, OSError):
+        result["error"] = "이미지 파일을 열 수 없어요."
+    except (asyncio.TimeoutError, openai.APITimeoutError):
+        result["error"] = TIMEOUT_MESSAGE
+    except ChatOverloaded as e:
+        result["error"] = str(e)
+    except CircuitOpen:
+        result["error"] = VISION_UNAVAILABLE_MESSAGE
+    except (KeyError, ValueError, httpx.HTTPError, openai.OpenAIError, LocalClassifierError):
+        result["error"] = "이미지 분석 중 오류가 발생했어요."
+    except Exception:
+        # 한 장이 이상해도 나머지 결과는 계속 보내요
+        logger.exception("일괄 분류 실패: %s", name)
+        result["error"] = "이미지 분석 중 오류가 발생했어요."
+    return result
+
+# 선생님용: 여러 장을 한 번에 분류하고, 끝나는 순서대로 한 줄씩(NDJSON) 돌려줘요
+@app.post("/api/classify/batch")
+async def classify_batch(files: list[UploadFile] = File(...)):
+    current_handler.set("batch")
+    images = await read_batch_uploads(files)
+    semaphore = asyncio.Semaphore(BATCH_FANOUT)
+    explanations = {}
+
+    async def results():
+        tasks = [asyncio.ensure_future(classify_batch_image(name, data, semaphore, explanations)) for name, data in images]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+# 퀴즈 점수 모으기 설정
+QUIZ_SCORE_REPORTING = os.getenv("QUIZ_SCORE_REPORTING", "1") == "1"
+QUIZ_SCORE_MAX_ANSWERS = 50
+QUIZ_BANK_PATH = os.path.join("static", "quiz.json")
+
+# 문제별 정답/오답 수를 공유 SQLite(SHARED_CACHE_DB)에 모아서 모든 워커가 같은 통계를 봐요
+# SHARED_CACHE_DB를 비우면 워커 메모리에만 모아요
+class QuizScoreStore:
+    def __init__(self, path):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS quiz_scores "
+            "(question_id TEXT PRIMARY KEY, correct INTEGER NOT NULL, wrong INTEGER NOT NULL)"
+        )
 
-#quiz-no {
-    background-color: #ffe0e0 !important;  /* 연한 빨강 */
-    color: #d32f2f !important;             /* 진한 빨강 텍스트 */
-    font-weight: bold;
-    border-radius: 12px;
-    padding: 10px 20px;
-}
+    def add(self, counts):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO quiz_scores (question_id, correct, wrong) VALUES (?, ?, ?) "
+                "ON CONFLICT (question_id) DO UPDATE SET correct = correct + excluded.correct, wrong = wrong + excluded.wrong",
+                [(question_id, scores["correct"], scores["wrong"]) for question_id, scores in counts.items()]
+            )
 
-#quiz-yes:hover {
-    background-color: #c8e6c9 !important;
-    transform: scale(1.05);
-    transition: 0.2s ease;
-}
+    def all(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT question_id, correct, wrong FROM quiz_scores ORDER BY question_id").fetchall()
+        return {question_id: {"correct": correct, "wrong": wrong} for question_id, correct, wrong in rows}
 
-#quiz-no:hover {
-    background-color: #ffcdd2 !important;
-    transform: scale(1.05);
-    transition: 0.2s ease;
-}
+quiz_scores = QuizScoreStore(SHARED_CACHE_DB or ":memory:")
+_quiz_ids = (None, frozenset())  # (quiz.json 수정 시각, 문제 id들)
 
+# quiz.json에 있는 문제 id만 점수로 받아요 (선생님이 파일을 고치면 다시 읽어요)
+def quiz_question_ids():
+    global _quiz_ids
+    try:
+        mtime = os.path.getmtime(QUIZ_BANK_PATH)
+        if mtime != _quiz_ids[0]:
+            with open(QUIZ_BANK_PATH, encoding="utf-8") as f:
+                questions = json.load(f)["questions"]
+            _quiz_ids = (mtime, frozenset(str(q["id"]) for q in questions))
+    except (OSError, ValueError, KeyError, TypeError):
+        logger.exception("quiz.json을 읽지 못했어요")
+    return _quiz_ids[1]
+
+# 브라우저가 모아서 보낸 퀴즈 답 (클릭마다가 아니라 여러 개씩 한 번에 와요)
+@app.post("/api/quiz/scores")
+async def report_quiz_scores(request: Request):
+    if not QUIZ_SCORE_REPORTING:
+        raise HTTPException(status_code=404)
+    try:
+        answers = json.loads(await request.body())["answers"][:QUIZ_SCORE_MAX_ANSWERS]
+        known_ids = quiz_question_ids()
+        counts = {}
+        for answer in answers:
+            result = "correct" if answer["correct"] else "wrong"
+            question_id = answer["id"]
+            if question_id not in known_ids:
+                continue
+            counts.setdefault(question_id, {"correct": 0, "wrong": 0})[result] += 1
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="잘못된 점수 형식이에요.")
+    try:
+        await asyncio.to_thread(quiz_scores.add, counts)
+    except sqlite3.Error:
+        logger.exception("퀴즈 점수 저장 실패")
+        raise HTTPException(status_code=503, detail="점수를 저장하지 못했어요.")
+    for question_id, scores in counts.items():
+        for result, n in scores.items():
+            if n:
+                metrics.inc("little_detective_quiz_answers_total", n, question=question_id, result=result)
+    return {"received": len(answers)}
+
+@app.get("/api/quiz/scores")
+def quiz_score_stats():
+    return quiz_scores.all()
+
+@app.get("/api/breakers/stats")
+def breaker_stats():
+    return {name: breaker.stats() for name, breaker in circuit_breakers.items()}
+
+@app.get("/api/queue/stats")
+def queue_stats():
+    return {"voice": voice_admission.stats(), "image": image_admission.stats(), "chat": {d.name: d.stats() for d in chat_deployments}}
+
+# 캐시/대기열 상태를 게이지로 내보내요
+def gauge_lines():
+    lines = ["# TYPE little_detective_cache_hit_ratio gauge"]
+    caches = {"tts": tts_store.stats(), "voice_answer": answer_cache.stats(), "image_hash": image_hash_index.stats()}
+    for name, stats in caches.items():
+        hits = stats.get("hits", stats.get("exact_hits", 0) + stats.get("similar_hits", 0))
+        lookups = hits + stats["misses"]
+        lines.append(f'little_detective_cache_hit_ratio{{cache="{name}"}} {hits / lookups if lookups else 0.0}')
+    lines.append("# TYPE little_detective_tts_cache_bytes gauge")
+    lines.append(f"little_detective_tts_cache_bytes {caches['tts']['bytes']}")
+    lines.append("# TYPE little_detective_queue_depth gauge")
+    for controller in (voice_admission, image_admission):
+        lines.append(f'little_detective_queue_depth{{handler="{controller.name}"}} {len(controller.waiters)}')
+    lines.append("# TYPE little_detective_active_requests gauge")
+    for controller in (voice_admission, image_admission):
+        lines.append(f'little_detective_active_requests{{handler="{controller.name}"}} {controller.active}')
+    lines.append("# TYPE little_detective_breaker_state gauge")
+    for name, breaker in circuit_breakers.items():
+        lines.append(f'little_detective_breaker_state{{upstream="{escape_label(name)}"}} {CircuitBreaker.STATES[breaker.state]}')
+    chat = {d.name: d.stats() for d in chat_deployments}
+    chat_gauges = (
+        ("little_detective_chat_concurrency_limit", "limit"),
+        ("little_detective_chat_active", "active"),
+        ("little_detective_chat_queue_depth", "queue_depth"),
+        ("little_detective_chat_remaining_tokens", "remaining_tokens"),
+        ("little_detective_chat_first_token_seconds", "first_token_seconds_avg"),
+        ("little_detective_chat_routing_weight", "weight")
+    )
+    for gauge, field in chat_gauges:
+        lines.append(f"# TYPE {gauge} gauge")
+        for name, stats in chat.items():
+            if stats[field] is not None:
+                lines.append(f'{gauge}{{deployment="{escape_label(name)}"}} {stats[field]}')
+    return "\n".join(lines) + "\n"
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render() + gauge_lines(), media_type="text/plain; version=0.0.4")
+
+# 백그라운드 준비 상태 (/ready)
+readiness = {"imports": False, "speech": False, "classifier": False}
+
+def warm_up_imports():
+    for module in LAZY_MODULES:
+        module.load()
+    for deployment in chat_deployments:
+        deployment.get_client()
+
+# 서버는 바로 뜨고, 무거운 준비는 뒤에서 해요
+async def warm_up():
+    await asyncio.to_thread(warm_up_imports)
+    readiness["imports"] = True
+
+    async def speech():
+        await asyncio.get_running_loop().run_in_executor(stt_pool, warm_up_speech_backend)
+        readiness["speech"] = True
+
+    async def classifier():
+        await asyncio.to_thread(warm_up_local_classifier)
+        readiness["classifier"] = True
+
+    await asyncio.gather(speech(), classifier())
+    if WARM_EXPLANATION_CACHE:
+        await warm_explanation_cache()
+
+@app.get("/ready")
+def ready():
+    is_ready = all(readiness.values())
+    return JSONResponse({"ready": is_ready, **readiness}, status_code=200 if is_ready else 503)
+
+@app.on_event("startup")
+async def on_startup():
+    await asyncio.to_thread(tts_store.sweep)
+    await asyncio.to_thread(sweep_legacy_tts_files, TTS_CACHE_DIR)
+    app.state.warmup_task = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await prediction_client.aclose()
+    for deployment in chat_deployments:
+        if deployment.client is not None:
+            await deployment.client.close()
+
+# 여러 워커로 돌릴 때 앞단 프록시(nginx)가 이 쿠키로 같은 워커에 보내줘요 (deploy/nginx.conf)
+STICKY_COOKIE = "ld_session"
+
+@app.middleware("http")
+async def sticky_session_cookie(request, call_next):
+    response = await call_next(request)
+    if STICKY_COOKIE not in request.cookies:
+        response.set_cookie(STICKY_COOKIE, secrets.token_hex(16), httponly=True, samesite="lax")
+    return response
 
+#css 스타일을 적용하기 위한 Gradio Blocks
+# 스타일은 static/style.css (브라우저가 캐시해요)
+with gr.Blocks(head=f"""
+<link rel="stylesheet" href="{static_files.url('style.css')}">
+<script src="{static_files.url('quiz.js')}" defer></script>
 """) as demo:
 
     selected = gr.State(value=False)
 
     with gr.Column():
 
-        gr.HTML("""
+        gr.HTML(f"""
             <div class="header-bar">
             <div class="header-left">
-                <img src="/static/logo.png" alt="꼬마환경탐정 로고" class="header-logo" />
+                <img src="{static_files.url('logo.png')}" alt="꼬마환경탐정 로고" class="header-logo" />
                 <div class="brand-text">
                 <div class="brand-title">꼬마환경탐정</div>
                 <div class="brand-sub">지구를 지키는 작지만 큰 실천, 지금 시작해요! 🌱</div>
@@ -585,10 +2522,10 @@ footer, .svelte-1ipelgc, .wrap.svelte-1ipelgc {
             </div>
         """)
 
-        gr.HTML("""
+        gr.HTML(f"""
         <!-- 탐정 인삿말 -->
         <div style="display: flex; align-items: center; justify-content: center; gap: 16px; margin-bottom: 24px;">
-            <img src="/static/icon.png" alt="캐릭터" class="bouncy-icon">
+            <img src="{static_files.url('icon.png')}" alt="캐릭터" class="bouncy-icon">
             <div>
                 <div style="text-align: left; font-size: 22px; font-weight: bold; margin-bottom: 6px;">
                     안녕! 나는 <span style="color: #2e7d32;">꼬마환경탐정</span>이야!
@@ -606,7 +2543,7 @@ footer, .svelte-1ipelgc, .wrap.svelte-1ipelgc {
         <div class="choice-bubble">
             <div class="character-wrapper">
                 <div class="character-hover-msg">분리수거를 올바르게 하면 지구가 웃어요! 😊</div>
-                <img src="/static/good.png" class="character-img" />
+                <img src="{static_files.url('good.png')}" class="character-img" />
             </div>
             <button class="speech-bubble left-bubble" onclick="document.querySelector('#good-button').click()">
                 <span class="bubble-text">분리수거 잘하면<br>지구가 깨끗해져요~!</span>
@@ -619,7 +2556,7 @@ footer, .svelte-1ipelgc, .wrap.svelte-1ipelgc {
             </button>
             <div class="character-wrapper">
                 <div class="character-hover-msg">정말 나를 선택할 거야...? 지구가 아파요 🥲</div>
-                <img src="/static/bad.png" class="character-img" />
+                <img src="{static_files.url('bad.png')}" class="character-img" />
             </div>
         </div>
         </div>
@@ -641,7 +2578,7 @@ footer, .svelte-1ipelgc, .wrap.svelte-1ipelgc {
                     
                     # ✅ 음성 재생 버튼 및 출력
                     voice_play_button = gr.Button("▶️ 음성 재생")
-                    voice_audio_output = gr.Audio()
+                    voice_audio_output = gr.HTML()
                     
                     # ✅ mp3 경로 저장용 상태
                     voice_tts_path_state = gr.State()
@@ -659,41 +2596,17 @@ footer, .svelte-1ipelgc, .wrap.svelte-1ipelgc {
 
                      # ✅ 음성 재생용 추가
                     play_button = gr.Button("▶️ 음성 재생")
-                    audio_output = gr.Audio()
+                    audio_output = gr.HTML()
 
                     # ✅ 내부적으로 음성 경로 저장할 상태
                     tts_path_state = gr.State()
 
             with gr.Column(visible=False, elem_id="quiz-section", elem_classes="tool-section1") as quiz_block:
-                gr.HTML("""
-                    <div style="background-color: #fff8e1; border: 2px dashed #fbc02d; border-radius: 16px; padding: 24px; text-align: center;">
-                        <h2 style="color: #f57f17; margin-bottom: 16px;">❓ 미니 퀴즈 타임!</h2>
-                        <p style="font-size: 18px; font-weight: bold; color: #5d4037;">🧠 Q. 종이컵은 종이로 분리수거해야 한다.</p>
-                    </div>
-                """)
-
-                with gr.Row():
-                    mini_quiz_yes = gr.Button("⭕", elem_id="quiz-yes")
-                    mini_quiz_no = gr.Button("❌", elem_id="quiz-no")
-
-                mini_quiz_result = gr.HTML(visible=False)
-                
-                gr.HTML("<hr>")
-
-                gr.HTML("""
-                    <div style="background-color: #fff8e1; border: 2px dashed #fbc02d; border-radius: 16px; padding: 24px; text-align: center;">
-                        <h2 style="color: #f57f17; margin-bottom: 16px;">❓ 미니 퀴즈 타임!</h2>
-                        <p style="font-size: 18px; font-weight: bold; color: #5d4037;">🧠 Q. 먹고 남은 치킨 상자는 일반쓰레기로 버려야 한다.</p>
-                    </div>
-                """)
-
-                with gr.Row():
-                    mini_quiz_yes_1 = gr.Button("⭕", elem_id="quiz-yes")
-                    mini_quiz_no_1 = gr.Button("❌", elem_id="quiz-no")
-
-                mini_quiz_result_1 = gr.HTML(visible=False)
-
-            
+                # 문제는 static/quiz.json, 정답 확인은 static/quiz.js 가 브라우저에서 해요
+                gr.HTML(
+                    f'<div id="quiz-bank" data-src="/static/quiz.json" data-report="{"1" if QUIZ_SCORE_REPORTING else "0"}" '
+                    f'data-correct-sound="{static_files.url("correct.mp3")}" data-wrong-sound="{static_files.url("wrong.mp3")}"></div>'
+                )
 
         # Gradio 앱 설정
         def good_selected():
@@ -722,12 +2635,15 @@ footer, .svelte-1ipelgc, .wrap.svelte-1ipelgc {
         image_input.change(
             fn=classify_and_explain,
             inputs=image_input,
-            outputs=[result, howto, tts_path_state]
+            outputs=[result, howto, tts_path_state],
+            api_name="classify",
+            # 동시 처리 수는 image_admission이 정해요
+            concurrency_limit=None
         )
 
         # 음성 재생 버튼 클릭 시 실행
         play_button.click(
-            fn=lambda path: path,
+            fn=audio_player_html,
             inputs=tts_path_state,
             outputs=audio_output,
         )
@@ -736,89 +2652,50 @@ footer, .svelte-1ipelgc, .wrap.svelte-1ipelgc {
         voice_input.change(
             fn=handle_voice_input,
             inputs=[voice_input],
-            outputs=[voice_output, voice_tts_path_state]
+            outputs=[voice_output, voice_tts_path_state],
+            api_name="voice",
+            # 동시 처리 수는 voice_admission이 정해요
+            concurrency_limit=None
         )
 
         # ✅ 음성 재생 버튼 → mp3 경로로 재생
         voice_play_button.click(
-            fn=lambda path: path,
+            fn=audio_player_html,
             inputs=[voice_tts_path_state],
             outputs=[voice_audio_output]
         )
 
 
-# 퀴즈 처리 함수
- # 출력용
-        #mini_quiz_result = gr.HTML(visible=False)
-        #mini_quiz_result_1 = gr.HTML(visible=False)
-
-# 퀴즈 처리 함수
-        def handle_mini_quiz(user_choice):
-            correct_answer = "❌"  # 직접 지정
-            if user_choice == correct_answer:
-                return gr.update(value="""
-                    <audio autoplay>
-                        <source src="/static/correct.mp3" type="audio/mpeg">
-                    </audio>
-                    <div class="correct-animate">
-                        🎉 <b>정답이에요!</b><br>종이컵은 일반 쓰레기예요! ♻️
-                    </div>
-                """, visible=True)
-            else:
-                return gr.update(value="""
-                    <audio autoplay>
-                        <source src="/static/wrong.mp3" type="audio/mpeg">
-                    </audio>
-                    <div class="wrong-animate">
-                        😢 <b>틀렸어요!</b><br>종이컵은 코팅 때문에 재활용이 안 돼요!
-                    </div>
-                """, visible=True)
-            
-    # 퀴즈 처리 함수
-    def handle_mini_quiz_1(user_choice):
-        correct_answer = "⭕"  # 직접 지정
-        if user_choice == correct_answer:
-            return gr.update(value="""
-                <audio autoplay>
-                    <source src="/static/correct.mp3" type="audio/mpeg">
-                </audio>
-                <div class="correct-animate">
-                    🎉 <b>정답이에요!</b><br>기름이 묻은 종이는 일반쓰레기에 버려주세요! ♻️
-                </div>
-            """, visible=True)
-        else:
-            return gr.update(value="""
-                <audio autoplay>
-                    <source src="/static/wrong.mp3" type="audio/mpeg">
-                </audio>
-                <div class="wrong-animate">
-                    😢 <b>틀렸어요!</b><br>기름이 묻은 종이는 종이에 버리면 안 돼요!
-                </div>
-            """, visible=True)
-
-
-    def handle_quiz_yes():
-        return handle_mini_quiz("⭕")
-
-    def handle_quiz_no():
-        return handle_mini_quiz("❌")
-    
-    def handle_quiz_yes_1():
-        return handle_mini_quiz_1("⭕")
-
-    def handle_quiz_no_1():
-        return handle_mini_quiz_1("❌")
-
-    mini_quiz_yes.click(fn=handle_quiz_yes, outputs=mini_quiz_result)
-    mini_quiz_no.click(fn=handle_quiz_no, outputs=mini_quiz_result)
-    mini_quiz_yes_1.click(fn=handle_quiz_yes_1, outputs=mini_quiz_result_1)
-    mini_quiz_no_1.click(fn=handle_quiz_no_1, outputs=mini_quiz_result_1)
 
+# Gradio 대기열은 바깥 안전장치로만 써요
+demo.queue(max_size=GRADIO_QUEUE_MAX_SIZE)
 
 # Gradio 앱 실행
 app = gr.mount_gradio_app(app, demo, path="/")
 
+# 워커 설정 (WORKERS > 1 이면 WORKER_BASE_PORT부터 포트 하나씩 워커를 띄워요)
+HOST = os.getenv("HOST", "127.0.0.1")
+PORT = int(os.getenv("PORT", "7860"))
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", str(PORT + 1)))
+
+def run_worker(port):
+    import uvicorn
+    uvicorn.run("main:app", host=HOST, port=port)
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=7860)
+    if WORKERS <= 1:
+        uvicorn.run(app, host=HOST, port=PORT)
+    else:
+        # Gradio 세션은 워커마다 따로라서 nginx가 쿠키로 고정(sticky)해줘야 해요
+        import multiprocessing
+        workers = [
+            multiprocessing.Process(target=run_worker, args=(WORKER_BASE_PORT + i,))
+            for i in range(WORKERS)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
 
@@ -0,0 +1,97 @@
+// 꼬마환경탐정 미니 퀴즈
+// 문제는 /static/quiz.json 에서 읽고, 정답 확인은 브라우저에서 해요 (클릭마다 서버에 가지 않아요).
+// 점수는 모아 두었다가 한 번에 /api/quiz/scores 로 보내요 (data-report="1" 일 때만).
+(function () {
+  var REPORT_BATCH_SIZE = 5;
+  var pending = [];
+  var answered = {};  // 문제 id → true (처음 고른 답만 점수로 보내요)
+
+  function escapeHtml(text) {
+    return String(text).replace(/[&<>"']/g, function (c) {
+      return { "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;" }[c];
+    });
+  }
+
+  function flushScores(container) {
+    if (!pending.length || container.dataset.report !== "1") {
+      return;
+    }
+    var body = JSON.stringify({ answers: pending.splice(0, pending.length) });
+    var blob = new Blob([body], { type: "application/json" });
+    if (!(navigator.sendBeacon && navigator.sendBeacon("/api/quiz/scores", blob))) {
+      fetch("/api/quiz/scores", { method: "POST", body: body, headers: { "Content-Type": "application/json" }, keepalive: true });
+    }
+  }
+
+  function renderQuestion(question) {
+    return (
+      '<div class="quiz-card" data-id="' + escapeHtml(question.id) + '">' +
+      '<div style="background-color: #fff8e1; border: 2px dashed #fbc02d; border-radius: 16px; padding: 24px; text-align: center;">' +
+      '<h2 style="color: #f57f17; margin-bottom: 16px;">❓ 미니 퀴즈 타임!</h2>' +
+      '<p style="font-size: 18px; font-weight: bold; color: #5d4037;">🧠 Q. ' + escapeHtml(question.question) + "</p>" +
+      "</div>" +
+      '<div class="quiz-buttons">' +
+      '<button class="quiz-yes" data-choice="O">⭕</button>' +
+      '<button class="quiz-no" data-choice="X">❌</button>' +
+      "</div>" +
+      '<div class="quiz-result"></div>' +
+      "</div>"
+    );
+  }
+
+  function answer(container, questions, button) {
+    var card = button.closest(".quiz-card");
+    var question = questions[card.dataset.id];
+    var correct = button.dataset.choice === question.answer;
+    var result = card.querySelector(".quiz-result");
+
+    var sound = correct ? container.dataset.correctSound : container.dataset.wrongSound;
+    new Audio(sound || (correct ? "/static/correct.mp3" : "/static/wrong.mp3")).play().catch(function () {});
+    result.innerHTML = correct
+      ? '<div class="correct-animate">🎉 <b>정답이에요!</b><br>' + escapeHtml(question.correct) + "</div>"
+      : '<div class="wrong-animate">😢 <b>틀렸어요!</b><br>' + escapeHtml(question.wrong) + "</div>";
+
+    if (answered[question.id]) {
+      return;
+    }
+    answered[question.id] = true;
+    pending.push({ id: question.id, tag: question.tag, correct: correct });
+    if (pending.length >= REPORT_BATCH_SIZE) {
+      flushScores(container);
+    }
+  }
+
+  function mount(container) {
+    container.dataset.mounted = "1";
+    fetch(container.dataset.src || "/static/quiz.json")
+      .then(function (response) { return response.json(); })
+      .then(function (bank) {
+        var questions = {};
+        bank.questions.forEach(function (question) { questions[question.id] = question; });
+        container.innerHTML = bank.questions.map(renderQuestion).join("<hr>");
+        container.addEventListener("click", function (event) {
+          var button = event.target.closest("button[data-choice]");
+          if (button) {
+            answer(container, questions, button);
+          }
+        });
+        document.addEventListener("visibilitychange", function () {
+          if (document.visibilityState === "hidden") {
+            flushScores(container);
+          }
+        });
+        window.addEventListener("pagehide", function () { flushScores(container); });
+      });
+  }
+
+  // Gradio가 화면을 나중에 그려서, 퀴즈 자리가 생길 때까지 지켜봐요
+  function mountWhenReady() {
+    var container = document.getElementById("quiz-bank");
+    if (container && !container.dataset.mounted) {
+      mount(container);
+    }
+  }
+
+  new MutationObserver(mountWhenReady).observe(document.documentElement, { childList: true, subtree: true });
+  mountWhenReady();
+})();
@@ -0,0 +1,73 @@
+# 배포 전에 한 번 실행하는 정적 파일 준비
+# 1. 텍스트 파일(css/js/json/svg/html)은 .gz / .br 로 미리 압축해 둬요 (brotli 패키지가 있을 때만 .br)
+# 2. PNG는 화질 손실 없이 다시 저장해서 용량을 줄여요
+#
+# python tools/build_assets.py [--static-dir static]
+
+import argparse
+import gzip
+import os
+
+TEXT_EXTENSIONS = (".css", ".js", ".json", ".svg", ".html", ".txt")
+
+
+def write_if_smaller(path, data, original_size):
+    # 압축해도 별로 안 줄어들면 만들지 않아요 (남아 있던 옛 파일도 지워요)
+    if len(data) < original_size * 0.9:
+        with open(path, "wb") as f:
+            f.write(data)
+        return True
+    if os.path.exists(path):
+        os.remove(path)
+    return False
+
+
+def precompress(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    made = []
+    if write_if_smaller(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0), len(data)):
+        made.append("gz")
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    if brotli is not None and write_if_smaller(path + ".br", brotli.compress(data, quality=11), len(data)):
+        made.append("br")
+    return made
+
+
+def optimize_png(path):
+    from PIL import Image
+
+    before = os.path.getsize(path)
+    tmp_path = path + ".tmp"
+    with Image.open(path) as image:
+        image.save(tmp_path, format="PNG", optimize=True)
+    after = os.path.getsize(tmp_path)
+    if after < before:
+        os.replace(tmp_path, path)
+        return before, after
+    os.remove(tmp_path)
+    return before, before
+
+
+def main():
+    parser = argparse.ArgumentParser(description="정적 파일 미리 압축 / PNG 최적화")
+    parser.add_argument("--static-dir", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static"))
+    args = parser.parse_args()
+
+    for root, _, names in os.walk(args.static_dir):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, args.static_dir)
+            if name.endswith(TEXT_EXTENSIONS):
+                made = precompress(path)
+                print(f"{relative}: {', '.join(made) if made else '압축 안 함'}")
+            elif name.endswith(".png"):
+                before, after = optimize_png(path)
+                print(f"{relative}: {before // 1024} KB → {after // 1024} KB")
+
+
+if __name__ == "__main__":
+    main()